@@ -3,10 +3,14 @@ import requests
 import json
 from typing import Dict, Any
 import os
+import time
 
 # Configuration
 API_BASE_URL = os.getenv("API_BASE_URL", st.secrets.get("API_BASE_URL", "http://localhost:8000"))
 
+# How long a fetched /status is reused before it is revalidated with the server
+STATUS_CACHE_SECONDS = 10
+
 def call_api(endpoint: str, method: str = "GET", data: Dict[Any, Any] = None) -> Dict[Any, Any]:
     """Make API calls to FastAPI backend"""
     url = f"{API_BASE_URL}{endpoint}"
@@ -35,6 +39,38 @@ def call_api(endpoint: str, method: str = "GET", data: Dict[Any, Any] = None) ->
         st.error(f"Request failed: {str(e)}")
         return {}
 
+def get_status(force: bool = False) -> Dict[Any, Any]:
+    """Fetch /status, reusing the cached copy while fresh and revalidating it by ETag"""
+    cached = st.session_state.get("status_cache")
+    if cached and not force and time.time() - cached["fetched_at"] < STATUS_CACHE_SECONDS:
+        return cached["data"]
+    
+    headers = {"If-None-Match": cached["etag"]} if cached and cached.get("etag") else {}
+    try:
+        response = requests.get(f"{API_BASE_URL}/status", headers=headers)
+        if response.status_code == 304:
+            cached["fetched_at"] = time.time()
+            return cached["data"]
+        if response.status_code == 200:
+            data = response.json()
+            st.session_state.status_cache = {
+                "etag": response.headers.get("ETag"),
+                "data": data,
+                "fetched_at": time.time()
+            }
+            return data
+        st.error(f"API Error ({response.status_code}): {response.text}")
+        return {}
+    except requests.exceptions.ConnectionError:
+        st.error("Cannot connect to the API server. Make sure FastAPI is running on localhost:8000")
+        return {}
+    except Exception as e:
+        st.error(f"Request failed: {str(e)}")
+        return {}
+
+def invalidate_status():
+    st.session_state.pop("status_cache", None)
+
 def main():
     st.set_page_config(
         page_title="GitHub RAG System",
@@ -49,10 +85,9 @@ def main():
     with st.sidebar:
         st.header("System Status")
         
-        if st.button("🔄 Refresh Status"):
-            st.rerun()
+        force_refresh = st.button("🔄 Refresh Status")
         
-        status = call_api("/status")
+        status = get_status(force=force_refresh)
         if status:
             st.success("✅ API Connected") if status else st.error("❌ API Disconnected")
             
@@ -61,12 +96,23 @@ def main():
             else:
                 st.warning("⚠️ No Database Found")
             
-            repos = status.get("ingested_repositories", [])
+            repos = status.get("repositories", [])
             if repos:
                 st.info(f"📚 {len(repos)} Repository(ies) Ingested")
                 with st.expander("View Repositories"):
                     for repo in repos:
-                        st.text(f"• {repo}")
+                        st.text(f"• {repo['url']}")
+                        details = []
+                        if repo.get("files"):
+                            details.append(f"{repo['files']} files")
+                        if repo.get("chunks"):
+                            details.append(f"{repo['chunks']} chunks")
+                        if repo.get("index_size_bytes"):
+                            details.append(f"{repo['index_size_bytes'] / 1e6:.1f} MB index")
+                        if repo.get("last_ingest_seconds"):
+                            details.append(f"ingested in {repo['last_ingest_seconds']:.0f}s")
+                        if details:
+                            st.caption(", ".join(details))
             else:
                 st.info("📚 No Repositories Ingested")
         
@@ -75,6 +121,7 @@ def main():
             if st.session_state.get("confirm_reset"):
                 result = call_api("/reset", method="DELETE")
                 if result:
+                    invalidate_status()
                     st.success("Database reset successfully!")
                     st.session_state.confirm_reset = False
                     st.rerun()
@@ -100,6 +147,7 @@ def main():
             else:
                 with st.spinner("Ingesting repository... This may take a few minutes."):
                     result = call_api("/ingest", method="POST", data={"github_url": github_url})
+                    invalidate_status()
                     
                     if result:
                         if result.get("success"):
@@ -127,11 +175,20 @@ def main():
         st.header("💬 Query Repository")
         
         # Check if database exists
-        status = call_api("/status")
+        status = get_status()
         if not status.get("database_exists"):
             st.warning("⚠️ No knowledge base found. Please ingest a repository first.")
             st.stop()
         
+        # Queries are scoped to one repository so only its index has to be loaded
+        repos = sorted(status.get("repositories", []), key=lambda repo: repo.get("updated_at") or 0, reverse=True)
+        all_repos = "All repositories"
+        selected_repo = st.selectbox(
+            "Repository",
+            [repo["url"] for repo in repos] + [all_repos],
+            help="Searching all repositories only covers the most recently used ones"
+        )
+        
         query = st.text_area(
             "Your Question",
             placeholder="What does this repository do? How do I use the main function? What are the key components?",
@@ -144,11 +201,28 @@ def main():
         with col_clear:
             if st.button("🗑️ Clear"):
                 st.session_state.query_history = []
+                # Start a fresh server-side conversation as well
+                if st.session_state.get("session_id"):
+                    call_api(f"/sessions/{st.session_state.session_id}", method="DELETE")
+                    st.session_state.session_id = None
                 st.rerun()
         
         if ask_button and query:
+            # Follow-up questions reuse the server-side session's context
+            if not st.session_state.get("session_id"):
+                st.session_state.session_id = call_api("/sessions", method="POST").get("session_id")
+            
             with st.spinner("Searching knowledge base..."):
-                result = call_api("/query", method="POST", data={"query": query, "k": 5})
+                result = call_api("/query", method="POST", data={
+                    "query": query,
+                    "k": 5,
+                    "repo": None if selected_repo == all_repos else selected_repo,
+                    "session_id": st.session_state.session_id
+                })
+                
+                if not result:
+                    # The session may have expired; the next question starts a new one
+                    st.session_state.session_id = None
                 
                 if result:
                     st.markdown("### 📝 Answer")
@@ -0,0 +1,289 @@
+"""
+Offline benchmark suite for the ingest and query paths.
+
+Runs against the dumps in data/ (optionally scaled up synthetically) with a stub LLM,
+and writes machine-readable JSON so results can be compared across commits. Each
+corpus/scale case runs in its own process, so its peak RSS is not inflated by earlier cases:
+
+    python bench.py --stub-embedder --scale 1 5 --concurrency 1 4 16 --output bench_results.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import platform
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+import concurrent.futures
+from types import SimpleNamespace
+
+import numpy as np
+from langchain.schema import Document
+from langchain_core.embeddings import Embeddings
+
+from rag import Rag, DATA_DIR, EMBED_BATCH_SIZE
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BENCH_FORMAT_VERSION = 1
+
+DEFAULT_QUERIES = [
+    "What does this repository do?",
+    "How is the backend server started?",
+    "Which files handle authentication?",
+    "Explain the main React components.",
+    "How are API requests sent to the server?",
+    "Where is the database configured?",
+    "What dependencies does the project use?",
+    "How is fraud detection implemented?",
+]
+
+
+class StubEmbeddings(Embeddings):
+    """Deterministic hashed bag-of-words embedder, so benchmarks run without downloading models"""
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            bucket = int(hashlib.md5(token.encode("utf-8")).hexdigest()[:8], 16)
+            vector[bucket % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class StubLLM:
+    """Stands in for ChatGroq; sleeps for a fixed latency and echoes the prompt size"""
+
+    def __init__(self, latency_ms=0.0):
+        self.latency_ms = latency_ms
+
+    def invoke(self, prompt):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return SimpleNamespace(content=f"stub answer ({len(str(prompt))} prompt chars)")
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, or None where unsupported"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    if sys.platform == "darwin":
+        return round(peak / (1024 * 1024), 1)
+    return round(peak / 1024, 1)
+
+
+def percentiles(samples):
+    """Summarise latency samples (seconds) as milliseconds"""
+    if not samples:
+        return {}
+    values = np.array(samples) * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+def git_commit():
+    """Current commit hash, so results can be matched to the code that produced them"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def load_corpora(data_dir, names=None):
+    """Load the bundled *_content.txt dumps, optionally filtered by substring"""
+    corpora = {}
+    for filename in sorted(os.listdir(data_dir)):
+        if not filename.endswith("_content.txt"):
+            continue
+        if names and not any(name.lower() in filename.lower() for name in names):
+            continue
+        with open(os.path.join(data_dir, filename), "r", encoding="utf-8") as f:
+            corpora[filename] = f.read()
+    return corpora
+
+
+def scale_content(content, factor):
+    """Build a synthetic corpus by repeating every file under a distinct path prefix"""
+    if factor <= 1:
+        return content
+    copies = [content]
+    for i in range(1, factor):
+        copies.append(re.sub(r"^File: (.+)$", rf"File: copy{i}/\1", content, flags=re.MULTILINE))
+    return "\n".join(copies)
+
+
+def bench_parse_split(rag, content, source):
+    started = time.perf_counter()
+    chunks = rag.split_doc_with_filenames([Document(page_content=content, metadata={"source": source})])
+    elapsed = time.perf_counter() - started
+    size_mb = len(content.encode("utf-8")) / (1024 * 1024)
+    return chunks, {
+        "seconds": round(elapsed, 4),
+        "bytes": len(content.encode("utf-8")),
+        "chunks": len(chunks),
+        "mb_per_second": round(size_mb / elapsed, 3) if elapsed else None,
+        "chunks_per_second": round(len(chunks) / elapsed, 1) if elapsed else None,
+    }
+
+
+def bench_embedding(rag, chunks, limit):
+    texts = [chunk.page_content for chunk in chunks[:limit]]
+    started = time.perf_counter()
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        rag.embeddings.embed_documents(texts[start:start + EMBED_BATCH_SIZE])
+    elapsed = time.perf_counter() - started
+    return {
+        "chunks": len(texts),
+        "batch_size": EMBED_BATCH_SIZE,
+        "seconds": round(elapsed, 4),
+        "chunks_per_second": round(len(texts) / elapsed, 1) if elapsed else None,
+    }
+
+
+def bench_index_build(rag, chunks):
+    started = time.perf_counter()
+    success = rag.create_db(chunks)
+    elapsed = time.perf_counter() - started
+    return {
+        "success": success,
+        "chunks": len(chunks),
+        "seconds": round(elapsed, 4),
+        "chunks_per_second": round(len(chunks) / elapsed, 1) if elapsed else None,
+    }
+
+
+def bench_queries(rag, queries, total, concurrency, k):
+    rng = random.Random(0)
+    workload = [rng.choice(queries) for _ in range(total)]
+
+    def run(query):
+        started = time.perf_counter()
+        rag.search_and_answer(query, k=k)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(run, workload))
+    wall = time.perf_counter() - started
+
+    result = percentiles(latencies)
+    result["concurrency"] = concurrency
+    result["queries_per_second"] = round(total / wall, 2) if wall else None
+    return result
+
+
+def run_case(args, name, factor):
+    """Benchmark one corpus at one scale; run in a fresh process so peak_rss_mb is this case's own"""
+    embeddings = StubEmbeddings() if args.stub_embedder else None
+    llm = StubLLM(latency_ms=args.llm_latency_ms)
+    content = load_corpora(args.data_dir, [name])[name]
+
+    with tempfile.TemporaryDirectory(prefix="gitoracle-bench-") as workdir:
+        rag = Rag(
+            data_dir=args.data_dir,
+            chroma_dir=os.path.join(workdir, "chroma"),
+            processed_files_path=os.path.join(workdir, "processed_files.json"),
+            embeddings=embeddings,
+            llm=llm
+        )
+        print(f"Benchmarking {name} x{factor}")
+
+        try:
+            scaled = scale_content(content, factor)
+            chunks, parse_split = bench_parse_split(rag, scaled, name)
+            return {
+                "corpus": name,
+                "scale": factor,
+                "parse_split": parse_split,
+                "embedding": bench_embedding(rag, chunks, args.embed_limit),
+                "index_build": bench_index_build(rag, chunks),
+                "query": [
+                    bench_queries(rag, DEFAULT_QUERIES, args.queries, concurrency, args.k)
+                    for concurrency in args.concurrency
+                ],
+                "peak_rss_mb": peak_rss_mb(),
+            }
+        finally:
+            rag.close()
+
+
+def run_benchmarks(args):
+    corpora = load_corpora(args.data_dir, args.corpus)
+    if not corpora:
+        raise SystemExit(f"No *_content.txt dumps found in {args.data_dir}")
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for name in corpora:
+        for factor in args.scale:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results.append(executor.submit(run_case, args, name, factor).result())
+
+    peaks = [entry["peak_rss_mb"] for entry in results if entry["peak_rss_mb"] is not None]
+    return {
+        "format_version": BENCH_FORMAT_VERSION,
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "embedder": "stub" if args.stub_embedder else "huggingface",
+            "llm_latency_ms": args.llm_latency_ms,
+            "args": vars(args),
+        },
+        "results": results,
+        "peak_rss_mb": max(peaks) if peaks else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark GitOracle ingest and query paths offline")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Directory containing *_content.txt dumps")
+    parser.add_argument("--corpus", nargs="*", help="Only benchmark dumps whose filename contains one of these")
+    parser.add_argument("--scale", nargs="+", type=int, default=[1], help="Synthetic corpus scale factors")
+    parser.add_argument("--stub-embedder", action="store_true", help="Use a hashed embedder instead of mpnet")
+    parser.add_argument("--embed-limit", type=int, default=512, help="Max chunks for the embedding throughput run")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4], help="Concurrent query clients")
+    parser.add_argument("--queries", type=int, default=50, help="Queries per concurrency level")
+    parser.add_argument("--k", type=int, default=5, help="Chunks retrieved per query")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Simulated LLM latency")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote benchmark results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+# Queued by close() to stop the worker thread
+_STOP = object()
+
+
+class QueryCoalescer:
+    """
+    Groups requests that arrive within a short window into a single batch call.
+
+    Callers submit one item and block on their own Future; a background worker
+    collects up to max_batch_size items, waiting at most max_wait_ms after the
+    first one, and passes the list to batch_fn. batch_fn must return one result
+    per item, in order. While a batch runs, new arrivals queue for the next one.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=16, max_wait_ms=5.0, on_batch=None):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self.on_batch = on_batch
+        self._queue = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_batch_size > 1
+
+    def submit(self, item):
+        """Queue an item and return a Future for its result"""
+        future = Future()
+        if not self.enabled:
+            # No batching configured: run inline, still through the same code path
+            self._run_batch([(item, future)])
+            return future
+
+        self._ensure_worker()
+        self._queue.put((item, future))
+        return future
+
+    def run(self, item):
+        """Submit an item and wait for its result"""
+        return self.submit(item).result()
+
+    def close(self, timeout=1.0):
+        """Stop the worker thread once the queued items have run"""
+        with self._start_lock:
+            worker = self._worker
+            self._worker = None
+        if worker is not None and worker.is_alive():
+            self._queue.put(_STOP)
+            worker.join(timeout)
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="query-coalescer", daemon=True)
+                self._worker.start()
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is _STOP:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                # Finish this batch first; the worker stops on the next collect
+                self._queue.put(_STOP)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        """Run one batch; every future is resolved, whatever batch_fn or on_batch do"""
+        try:
+            items = [item for item, _ in batch]
+            if self.on_batch:
+                self.on_batch(len(items))
+            results = list(self.batch_fn(items))
+            if len(results) != len(items):
+                raise RuntimeError(f"Batch function returned {len(results)} results for {len(items)} items")
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        except BaseException as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
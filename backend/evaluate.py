@@ -0,0 +1,169 @@
+"""
+Retrieval quality and latency evaluation against a locally ingested repository.
+
+Each configuration (embedding model, chunking, retrieval options) gets its own
+throwaway index built from data/<repo>_content.txt; the golden questions are then
+answered by Rag.retrieve only (no LLM), and recall@k, MRR and latency are reported:
+
+    python evaluate.py eval/expenflow_golden.json --output eval_results.json
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from ingest import RepoIngestor
+from rag import Rag, DATA_DIR, EMBEDDING_MODEL, CHUNK_SIZE, CHUNK_OVERLAP, DEFAULT_K
+from bench import StubEmbeddings, percentiles, git_commit, peak_rss_mb
+
+DEFAULT_CONFIGS = [
+    {"name": "baseline", "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP},
+    {"name": "small-chunks", "chunk_size": 500, "chunk_overlap": 100},
+    {"name": "large-chunks", "chunk_size": 2000, "chunk_overlap": 400},
+    {"name": "baseline-mmr", "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "use_mmr": True},
+    {"name": "minilm", "embedding_model": "sentence-transformers/all-MiniLM-L6-v2"},
+]
+
+
+def load_golden_set(path):
+    """Load {"repo": url, "questions": [{"question", "expected_file"}, ...]}"""
+    with open(path, "r", encoding="utf-8") as f:
+        golden = json.load(f)
+    if not golden.get("questions"):
+        raise ValueError(f"Golden set {path} has no questions")
+    return golden
+
+
+def make_embeddings(config, cache):
+    """Build (or reuse) the embedder for a config; 'stub' selects the offline hashed embedder"""
+    model = config.get("embedding_model", EMBEDDING_MODEL)
+    key = (model, json.dumps(config.get("model_kwargs", {}), sort_keys=True))
+    if key not in cache:
+        if model == "stub":
+            cache[key] = StubEmbeddings()
+        else:
+            cache[key] = HuggingFaceEmbeddings(model_name=model, model_kwargs=config.get("model_kwargs", {}))
+    return cache[key]
+
+
+def rank_of(expected_file, chunks):
+    """1-based rank of the first chunk from expected_file, or None"""
+    seen = []
+    for chunk in chunks:
+        filename = chunk["metadata"].get("filename")
+        if filename not in seen:
+            seen.append(filename)
+        if filename == expected_file:
+            return len(seen)
+    return None
+
+
+def evaluate_config(config, golden, content_path, embeddings_cache, k):
+    embeddings = make_embeddings(config, embeddings_cache)
+
+    with tempfile.TemporaryDirectory(prefix="gitoracle-eval-") as workdir:
+        rag = Rag(
+            data_dir=os.path.dirname(content_path),
+            chroma_dir=os.path.join(workdir, "chroma"),
+            processed_files_path=os.path.join(workdir, "processed_files.json"),
+            embeddings=embeddings,
+            chunk_size=config.get("chunk_size", CHUNK_SIZE),
+            chunk_overlap=config.get("chunk_overlap", CHUNK_OVERLAP),
+            # Questions run one at a time, so batching would only add wait time to the latency
+            batch_max_size=1
+        )
+
+        started = time.perf_counter()
+        chunks = rag.split_doc_with_filenames(rag.load_doc(content_path))
+        if not rag.create_db(chunks):
+            raise RuntimeError(f"Index build failed for config {config['name']}")
+        build_seconds = time.perf_counter() - started
+
+        options = rag.resolve_retrieval_options(
+            k=config.get("k", k),
+            fetch_k=config.get("fetch_k"),
+            use_mmr=config.get("use_mmr", False),
+            score_threshold=config.get("score_threshold")
+        )
+
+        hits = 0
+        reciprocal_ranks = []
+        latencies = []
+        misses = []
+        for item in golden["questions"]:
+            started = time.perf_counter()
+            retrieved = rag.retrieve(item["question"], options)
+            latencies.append(time.perf_counter() - started)
+
+            rank = rank_of(item["expected_file"], retrieved)
+            if rank is not None:
+                hits += 1
+                reciprocal_ranks.append(1.0 / rank)
+            else:
+                reciprocal_ranks.append(0.0)
+                misses.append(item["question"])
+        rag.close()
+
+    total = len(golden["questions"])
+    return {
+        "config": config,
+        "retrieval": options,
+        "chunks": len(chunks),
+        "index_build_seconds": round(build_seconds, 3),
+        f"recall@{options['k']}": round(hits / total, 4),
+        "mrr": round(sum(reciprocal_ranks) / total, 4),
+        "latency": percentiles(latencies),
+        "misses": misses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate retrieval quality and latency per configuration")
+    parser.add_argument("golden", help="Golden set JSON file")
+    parser.add_argument("--configs", help="JSON file with a list of configurations (defaults to a built-in sweep)")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Directory containing the ingested repo dumps")
+    parser.add_argument("--k", type=int, default=DEFAULT_K, help="Default k when a config does not set one")
+    parser.add_argument("--output", default="eval_results.json", help="Where to write the JSON results")
+    args = parser.parse_args()
+
+    golden = load_golden_set(args.golden)
+    configs = DEFAULT_CONFIGS
+    if args.configs:
+        with open(args.configs, "r", encoding="utf-8") as f:
+            configs = json.load(f)
+
+    content_path = os.path.join(args.data_dir, RepoIngestor(args.data_dir).get_filename(golden["repo"]))
+    if not os.path.exists(content_path):
+        raise SystemExit(f"{golden['repo']} is not ingested locally (missing {content_path})")
+
+    embeddings_cache = {}
+    results = []
+    for config in configs:
+        print(f"Evaluating config: {config['name']}")
+        result = evaluate_config(config, golden, content_path, embeddings_cache, args.k)
+        results.append(result)
+        recall_key = f"recall@{result['retrieval']['k']}"
+        print(f"  {recall_key}={result[recall_key]:.3f} mrr={result['mrr']:.3f} "
+              f"p50={result['latency']['p50_ms']:.1f}ms p95={result['latency']['p95_ms']:.1f}ms")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "golden": args.golden,
+            "repo": golden["repo"],
+            "questions": len(golden["questions"]),
+            "peak_rss_mb": peak_rss_mb(),
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote evaluation results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import chromadb
+from chromadb.config import Settings
+from chromadb.api.client import SharedSystemClient
+from langchain_chroma import Chroma
+from storage import atomic_write_json
+
+# Collection created by the original single-index layout; still served from the root store
+LEGACY_COLLECTION = "langchain"
+
+# Each repo has its own store in <persist_directory>/repos/<collection name>
+REPOS_DIRNAME = "repos"
+
+# Records which repo a store belongs to, so stores can be listed without opening them
+REPO_KEY_FILE = "repo_key.json"
+
+# Prefix of directories being built by a snapshot import; never served
+STAGING_PREFIX = ".staging-"
+
+# Rough per-vector HNSW overhead on top of the raw float32 vector (links + bookkeeping)
+HNSW_BYTES_PER_VECTOR = 256
+
+# How often the list of stores is re-read even if the store directories look unchanged
+COLLECTION_REFRESH_SECONDS = 30
+
+# Queries without a repo search at most this many indexes, resident ones first
+UNSCOPED_MAX_REPOS = int(os.getenv("UNSCOPED_MAX_REPOS", "8"))
+
+# Chroma's catalog in the root (legacy) store
+STORE_DB_FILE = "chroma.sqlite3"
+
+
+def collection_name_for(repo_key):
+    """Stable Chroma collection name for a repo dump key (names must be short and alphanumeric)"""
+    return "repo-" + hashlib.md5(repo_key.encode("utf-8")).hexdigest()[:16]
+
+
+def open_client(path):
+    """Persistent Chroma client for one store directory"""
+    return chromadb.PersistentClient(
+        path=path,
+        settings=Settings(is_persistent=True, persist_directory=path, anonymized_telemetry=False)
+    )
+
+
+def close_client(client):
+    """Stop a client's system and drop it from Chroma's per-path cache, so its loaded indexes are freed"""
+    system = SharedSystemClient._identifier_to_system.pop(client._identifier, None)
+    if system is not None:
+        system.stop()
+
+
+def write_repo_key(path, repo_key):
+    atomic_write_json(os.path.join(path, REPO_KEY_FILE), {"repo_key": repo_key})
+
+
+def _identity(path):
+    try:
+        stat = os.stat(path)
+        return stat.st_dev, stat.st_ino
+    except OSError:
+        return None
+
+
+class RepoIndexManager:
+    """
+    Keeps one Chroma store per repo and only the hot ones open.
+
+    Every repo's collection lives in its own persist directory with its own
+    client. A repo's store is opened on its first query and its resident size
+    estimated from the vector count. When the estimated total exceeds the memory
+    budget, the least recently used repos are evicted: their client is stopped
+    and dropped from Chroma's shared-system cache, which releases the loaded
+    HNSW index. (Chroma's own segment cache limits are ignored by its Rust
+    backend, so eviction does not rely on them.) Collections from the original
+    single-store layout are still served from the root store.
+    """
+
+    def __init__(self, persist_directory, embeddings, memory_budget_bytes):
+        self.persist_directory = persist_directory
+        self.repos_directory = os.path.join(persist_directory, REPOS_DIRNAME)
+        self.embeddings = embeddings
+        self.memory_budget_bytes = memory_budget_bytes
+        self._lock = threading.RLock()
+        self._clients = {}  # store path -> open client
+        self._client_identities = {}  # store path -> directory identity when the client was opened
+        self._resident = OrderedDict()  # collection name -> Chroma handle, in LRU order
+        self._pinned = {}  # collection name -> exports currently reading it
+        self._stats = {}
+        self._collections = {}  # collection name -> repo key
+        self._root_collections = set()  # names served from the root store
+        self._refreshed_at = 0.0
+        self._store_signature = None
+        self.evictions = 0
+
+    def store_path(self, collection_name):
+        if collection_name in self._root_collections:
+            return self.persist_directory
+        return os.path.join(self.repos_directory, collection_name)
+
+    def _client(self, path):
+        with self._lock:
+            if path not in self._clients:
+                self._clients[path] = open_client(path)
+                self._client_identities[path] = _identity(path)
+            return self._clients[path]
+
+    def _close(self, path):
+        with self._lock:
+            client = self._clients.pop(path, None)
+            self._client_identities.pop(path, None)
+            if client is not None:
+                close_client(client)
+
+    def _signature(self):
+        """Changes whenever a store is created, deleted or replaced, or the root store is written"""
+        root_db = os.path.join(self.persist_directory, STORE_DB_FILE)
+        try:
+            root_stat = os.stat(root_db)
+            root = (root_stat.st_ino, root_stat.st_mtime_ns)
+        except OSError:
+            root = None
+        try:
+            repos_stat = os.stat(self.repos_directory)
+            repos = (repos_stat.st_ino, repos_stat.st_mtime_ns)
+        except OSError:
+            repos = None
+        return _identity(self.persist_directory), repos, root
+
+    def open(self, collection_name, repo_key=None):
+        """Open (creating if needed) a collection without tracking it (writes)"""
+        path = self.store_path(collection_name)
+        os.makedirs(path, exist_ok=True)
+        handle = Chroma(
+            collection_name=collection_name,
+            embedding_function=self.embeddings,
+            client=self._client(path),
+            collection_metadata={"repo_key": repo_key} if repo_key else None
+        )
+        if repo_key and path != self.persist_directory:
+            write_repo_key(path, repo_key)
+        return handle
+
+    @contextmanager
+    def using(self, collection_name):
+        """Open a collection for a long read (export) that eviction must not close underneath"""
+        with self._lock:
+            self._pinned[collection_name] = self._pinned.get(collection_name, 0) + 1
+        try:
+            yield self.open(collection_name)
+        finally:
+            with self._lock:
+                self._pinned[collection_name] -= 1
+                if not self._pinned[collection_name]:
+                    del self._pinned[collection_name]
+                    if collection_name not in self._resident:
+                        self._evict(collection_name)
+
+    def get_collection(self, collection_name):
+        """Raw Chroma collection, from its repo store or the root store (untracked)"""
+        return self._client(self.store_path(collection_name)).get_collection(collection_name)
+
+    def list_collections(self):
+        """Names of every collection: one per repo store, plus any left in the root store"""
+        names = []
+        if os.path.isdir(self.repos_directory):
+            names = sorted(
+                name for name in os.listdir(self.repos_directory)
+                if not name.startswith(".") and os.path.isdir(os.path.join(self.repos_directory, name))
+            )
+        root = set()
+        if os.path.exists(os.path.join(self.persist_directory, STORE_DB_FILE)):
+            # chromadb < 0.6 returns Collection objects, newer versions return names
+            root = {
+                c if isinstance(c, str) else c.name
+                for c in self._client(self.persist_directory).list_collections()
+            }
+        with self._lock:
+            self._root_collections = root
+        return names + sorted(root)
+
+    def delete(self, collection_name):
+        """Delete a collection and its store; the caller must hold the store write lock"""
+        with self._lock:
+            path = self.store_path(collection_name)
+            self.forget(collection_name)
+            if path == self.persist_directory:
+                self._client(path).delete_collection(collection_name)
+                self._root_collections.discard(collection_name)
+            else:
+                self._close(path)
+                shutil.rmtree(path, ignore_errors=True)
+
+    def replace_all(self, staging_directory):
+        """Swap in the stores built under staging_directory, dropping every current store (snapshot import)"""
+        with self._lock:
+            self.forget()
+            for name in os.listdir(self.persist_directory):
+                path = os.path.join(self.persist_directory, name)
+                if path == staging_directory:
+                    continue
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            os.replace(staging_directory, self.repos_directory)
+
+    def register(self, collection_name, repo_key):
+        """Record a collection written by this process and drop any stale resident handle"""
+        with self._lock:
+            self._collections[collection_name] = repo_key
+            self._resident.pop(collection_name, None)
+            self._stats.pop(collection_name, None)
+
+    def refresh(self, force=False):
+        """Re-read the stores present on disk, closing clients whose store another worker replaced"""
+        with self._lock:
+            signature = self._signature()
+            if (not force and signature == self._store_signature
+                    and time.monotonic() - self._refreshed_at < COLLECTION_REFRESH_SECONDS):
+                return
+
+            if not os.path.exists(self.persist_directory):
+                # Reset by another worker: nothing to serve until something is ingested again
+                self.forget()
+                self._store_signature = signature
+                self._refreshed_at = time.monotonic()
+                return
+
+            # Stores deleted and recreated (re-ingest, reset, snapshot import) must be reopened
+            for path, identity in list(self._client_identities.items()):
+                if _identity(path) != identity:
+                    for name in [n for n in self._resident if self.store_path(n) == path]:
+                        self._resident.pop(name)
+                        self._stats.pop(name, None)
+                    self._close(path)
+
+            collections = {}
+            for name in self.list_collections():
+                if name in self._root_collections:
+                    if name == LEGACY_COLLECTION:
+                        collections[name] = "legacy"
+                    else:
+                        metadata = self.get_collection(name).metadata or {}
+                        collections[name] = metadata.get("repo_key", name)
+                    continue
+                try:
+                    with open(os.path.join(self.repos_directory, name, REPO_KEY_FILE), "r") as f:
+                        collections[name] = json.load(f)["repo_key"]
+                except (OSError, ValueError, KeyError):
+                    collections[name] = name
+
+            for name in [n for n in self._resident if n not in collections]:
+                self._evict(name)
+
+            self._collections = collections
+            self._store_signature = signature
+            self._refreshed_at = time.monotonic()
+
+    def collections_for(self, repo_key=None):
+        """Collections holding one repo, or every collection when repo_key is None"""
+        self.refresh(force=repo_key is not None and collection_name_for(repo_key) not in self._collections)
+        with self._lock:
+            if repo_key is None:
+                return list(self._collections)
+            name = collection_name_for(repo_key)
+            return [name] if name in self._collections else []
+
+    def search_targets(self, repo_key=None):
+        """
+        Collections a query searches. Unscoped queries are capped at UNSCOPED_MAX_REPOS,
+        most recently used first, so they do not load (and cycle) every repo's index.
+        """
+        names = self.collections_for(repo_key)
+        if repo_key is not None or len(names) <= UNSCOPED_MAX_REPOS:
+            return names
+        with self._lock:
+            resident = [name for name in reversed(self._resident) if name in self._collections]
+        others = [name for name in names if name not in resident]
+        return (resident + others)[:UNSCOPED_MAX_REPOS]
+
+    def acquire(self, collection_name, dim):
+        """
+        Return a handle for querying a repo index, loading it and evicting cold repos if needed.
+        Returns None if another worker deleted the repo's store since the last refresh.
+        """
+        with self._lock:
+            if collection_name not in self._resident and not os.path.isdir(self.store_path(collection_name)):
+                self.forget(collection_name)
+                return None
+
+            stats = self._stats.setdefault(collection_name, {
+                "repo": self._collections.get(collection_name, collection_name),
+                "vectors": None,
+                "estimated_bytes": 0,
+                "hits": 0,
+                "loads": 0,
+                "last_used": None,
+            })
+
+            if collection_name in self._resident:
+                self._resident.move_to_end(collection_name)
+            else:
+                handle = self.open(collection_name)
+                vectors = handle._collection.count()
+                stats["vectors"] = vectors
+                stats["estimated_bytes"] = vectors * (dim * 4 + HNSW_BYTES_PER_VECTOR)
+                stats["loads"] += 1
+                self._resident[collection_name] = handle
+
+            stats["hits"] += 1
+            stats["last_used"] = time.time()
+            self._enforce_budget(keep=collection_name)
+            return self._resident[collection_name]
+
+    def _enforce_budget(self, keep):
+        while self.resident_bytes() > self.memory_budget_bytes and len(self._resident) > 1:
+            name = next(iter(self._resident))
+            if name == keep:
+                self._resident.move_to_end(name)
+                name = next(iter(self._resident))
+            self._evict(name)
+            self.evictions += 1
+            print(f"Evicted cold repo index {self._stats[name]['repo']} ({name})")
+
+    def _evict(self, collection_name):
+        """Drop a resident index and close its client, unless an export or another resident index still uses it"""
+        self._resident.pop(collection_name, None)
+        path = self.store_path(collection_name)
+        if collection_name in self._pinned or any(self.store_path(n) == path for n in self._resident):
+            return
+        self._close(path)
+
+    def resident_bytes(self):
+        return sum(self._stats[name]["estimated_bytes"] for name in self._resident)
+
+    def forget(self, collection_name=None):
+        """Drop tracking for one collection, or close every client and drop everything (reset, snapshot import)"""
+        with self._lock:
+            if collection_name is None:
+                for path in list(self._clients):
+                    self._close(path)
+                self._resident.clear()
+                self._stats.clear()
+                self._collections.clear()
+                self._root_collections = set()
+                self._refreshed_at = 0.0
+                self._store_signature = None
+            else:
+                self._evict(collection_name)
+                self._stats.pop(collection_name, None)
+                self._collections.pop(collection_name, None)
+
+    def status(self):
+        with self._lock:
+            repos = []
+            for name, repo_key in self._collections.items():
+                stats = self._stats.get(name, {})
+                repos.append({
+                    "repo": repo_key,
+                    "collection": name,
+                    "state": "resident" if name in self._resident else ("evicted" if stats.get("loads") else "not_loaded"),
+                    "vectors": stats.get("vectors"),
+                    "estimated_bytes": stats.get("estimated_bytes", 0),
+                    "hits": stats.get("hits", 0),
+                    "loads": stats.get("loads", 0),
+                    "last_used": stats.get("last_used"),
+                })
+            return {
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "resident_bytes": self.resident_bytes(),
+                "resident_count": len(self._resident),
+                "open_clients": len(self._clients),
+                "evictions": self.evictions,
+                "repos": repos,
+            }
@@ -2,6 +2,8 @@ import os
 import re
 import asyncio
 import nest_asyncio
+from metrics import timed, BYTES_INGESTED
+from storage import atomic_write_text
 
 # Apply nest_asyncio to allow nested event loops
 nest_asyncio.apply()
@@ -23,7 +25,8 @@ class RepoIngestor:
             print(f"Ingesting repository: {url}")
             
             # Try different approaches to handle async
-            result = self._safe_ingest(url)
+            with timed("gitingest_fetch"):
+                result = self._safe_ingest(url)
             
             if not result:
                 print("Failed to get repository content")
@@ -47,33 +50,38 @@ class RepoIngestor:
 
             print(f"Retrieved content length: {len(content)} characters")
 
-            # making unique name for every repo -> main goal to avoid conflicts
-            safe_name = self.clean_fname(url)
-            content_file = os.path.join(self.data_dir, f"{safe_name}_content.txt")
+            # gitingest only reports the commit for commit-pinned URLs; record it for /status
+            if "Commit:" not in summary:
+                commit = self.get_head_commit(url)
+                if commit:
+                    summary = f"Commit: {commit}\n" + summary
+            BYTES_INGESTED.inc(len(content.encode("utf-8")))
 
-            # storing file with a detailed structure
-            with open(content_file, "w", encoding="utf-8") as f:
+            with timed("write_files"):
+                # making unique name for every repo -> main goal to avoid conflicts
+                safe_name = self.clean_fname(url)
+                content_file = os.path.join(self.data_dir, f"{safe_name}_content.txt")
+
+                # storing file with a detailed structure
+                parts = []
                 if summary:
-                    f.write("=== REPOSITORY SUMMARY ===\n")
-                    f.write(summary)
-                    f.write("\n\n")
+                    parts.append("=== REPOSITORY SUMMARY ===\n" + summary + "\n\n")
                 
                 if tree:
-                    f.write("=== REPOSITORY STRUCTURE ===\n")
-                    f.write(tree)
-                    f.write("\n\n")
+                    parts.append("=== REPOSITORY STRUCTURE ===\n" + tree + "\n\n")
                 
-                f.write("=== REPOSITORY CONTENT ===\n")
-                f.write(content)
+                parts.append("=== REPOSITORY CONTENT ===\n" + content)
+
+                # written atomically so a concurrent train() never reads a half-written dump
+                atomic_write_text(content_file, "".join(parts))
 
-            print(f"Saved repository content to: {content_file}")
+                print(f"Saved repository content to: {content_file}")
             
-            # saving tree separately for repo structure
-            if tree:
-                tree_file = os.path.join(self.data_dir, f"{safe_name}_tree.txt")
-                with open(tree_file, "w", encoding="utf-8") as f:
-                    f.write(tree)
-                print(f"Saved repository tree to: {tree_file}")
+                # saving tree separately for repo structure
+                if tree:
+                    tree_file = os.path.join(self.data_dir, f"{safe_name}_tree.txt")
+                    atomic_write_text(tree_file, tree)
+                    print(f"Saved repository tree to: {tree_file}")
 
             return True
 
@@ -172,6 +180,24 @@ class RepoIngestor:
             print(f"Fallback method also failed: {e}")
             return None
 
+    def get_head_commit(self, url):
+        """Latest commit on the default branch, via the GitHub API, or None if it cannot be fetched"""
+        try:
+            import requests
+
+            parts = url.rstrip('/').replace('https://github.com/', '').split('/')
+            if len(parts) < 2:
+                return None
+            owner, repo = parts[0], re.sub(r'\.git$', '', parts[1])
+
+            response = requests.get(f"https://api.github.com/repos/{owner}/{repo}/commits/HEAD", timeout=10)
+            if response.status_code != 200:
+                return None
+            return response.json().get("sha")
+        except Exception as e:
+            print(f"Could not look up the head commit: {e}")
+            return None
+
     def get_filename(self, url):
         """Returns the filename for the content file"""
         safe_name = self.clean_fname(url)
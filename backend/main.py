@@ -1,10 +1,19 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, File, HTTPException, Request, Response, UploadFile
+from fastapi.responses import FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Dict, List
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
 import os
+import json
+import time
+import hashlib
 from ingest import RepoIngestor
 from rag import Rag
+from metrics import render_metrics, CACHE_HITS
+import shutil
+import tempfile
 import traceback
 
 app = FastAPI(title="GitHub RAG API", description="Ingest GitHub repos and query with RAG")
@@ -24,15 +33,39 @@ class IngestRequest(BaseModel):
 
 class QueryRequest(BaseModel):
     query: str
+    k: int = Field(5, ge=1, le=50, description="Number of chunks passed to the LLM")
+    fetch_k: Optional[int] = Field(None, ge=1, le=200, description="Candidates fetched before MMR/threshold filtering")
+    use_mmr: bool = Field(False, description="Diversify chunks with maximal marginal relevance")
+    mmr_lambda: float = Field(0.5, ge=0.0, le=1.0, description="MMR trade-off: 1 = relevance only, 0 = diversity only")
+    score_threshold: Optional[float] = Field(None, le=1.0, description="Drop chunks with a lower relevance score")
+    max_context_chars: Optional[int] = Field(None, ge=1, description="Cap on the context size sent to the LLM")
+    repo: Optional[str] = Field(None, description="Only search this repository's index (GitHub URL); all repos when omitted")
+    session_id: Optional[str] = Field(None, description="Conversation session from POST /sessions; follow-ups reuse its context")
+    structural_routing: bool = Field(True, description="Answer path/listing/file-type questions from the repo tree without the LLM")
+    include_timings: bool = Field(False, description="Return a per-stage timing breakdown in milliseconds")
 
 class IngestResponse(BaseModel):
     success: bool
     message: str
     files_created: List[str] = []
 
+class ChunkScore(BaseModel):
+    filename: str
+    source: str
+    score: float
+
 class QueryResponse(BaseModel):
     response: str
     sources: List[str]
+    retrieval: Dict[str, Any] = {}
+    chunks: List[ChunkScore] = []
+    timings: Optional[Dict[str, float]] = None
+    session_id: Optional[str] = None
+
+class SessionResponse(BaseModel):
+    session_id: str
+    ttl_seconds: float
+    max_turns: int
 
 # Global instances
 ingestor = RepoIngestor()
@@ -51,8 +84,10 @@ async def ingest_repo(request: IngestRequest):
         if not github_url:
             raise HTTPException(status_code=400, detail="GitHub URL is required")
         
-        # Simple function call to ingest repo
-        success = ingestor.ingest_repo(github_url)
+        started = time.perf_counter()
+        
+        # Simple function call to ingest repo (blocking work runs off the event loop)
+        success = await run_in_threadpool(ingestor.ingest_repo, github_url)
         
         if not success:
             return IngestResponse(
@@ -64,8 +99,8 @@ async def ingest_repo(request: IngestRequest):
         content_file = ingestor.get_filename(github_url)
         tree_file = ingestor.get_tree_filename(github_url)
         
-        # Train the RAG model
-        train_success = rag.train(github_url)
+        # Train the RAG model; waits on the store lock, so it must not block the event loop
+        train_success = await run_in_threadpool(rag.train, github_url)
         
         if not train_success:
             return IngestResponse(
@@ -73,6 +108,15 @@ async def ingest_repo(request: IngestRequest):
                 message="Repository ingested but RAG training failed."
             )
         
+        # Merges into the shared stats file under its lock
+        await run_in_threadpool(
+            rag.status.update_repo,
+            rag.repo_key(github_url),
+            url=github_url,
+            last_ingest_seconds=round(time.perf_counter() - started, 3),
+            last_ingest_at=time.time()
+        )
+        
         return IngestResponse(
             success=True,
             message=f"Successfully ingested and trained on repository: {github_url}",
@@ -98,12 +142,34 @@ async def query_rag(request: QueryRequest):
                 detail="No knowledge base found. Please ingest a repository first."
             )
         
-        # Simple function call to query - using the method that takes query_text parameter
-        result = rag.search_and_answer(request.query)
+        if request.session_id and rag.sessions.get(request.session_id) is None:
+            raise HTTPException(status_code=404, detail="Session not found or expired. Create a new one via POST /sessions.")
+        
+        if request.repo and not rag.has_repo(request.repo):
+            raise HTTPException(status_code=404, detail=f"Repository not ingested: {request.repo}")
+        
+        # Run in the threadpool so concurrent queries can be coalesced into one batch
+        result = await run_in_threadpool(
+            rag.search_and_answer,
+            request.query,
+            k=request.k,
+            fetch_k=request.fetch_k,
+            use_mmr=request.use_mmr,
+            mmr_lambda=request.mmr_lambda,
+            score_threshold=request.score_threshold,
+            max_context_chars=request.max_context_chars,
+            repo=request.repo,
+            structural_routing=request.structural_routing,
+            session_id=request.session_id
+        )
         
         return QueryResponse(
             response=result["response"],
-            sources=result["sources"]
+            sources=result["sources"],
+            retrieval=result["retrieval"],
+            chunks=result["chunks"],
+            timings=result["timings"] if request.include_timings else None,
+            session_id=result["session_id"]
         )
         
     except HTTPException:
@@ -113,23 +179,58 @@ async def query_rag(request: QueryRequest):
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.post("/sessions", response_model=SessionResponse)
+async def create_session():
+    """Start a conversation session; pass its id to /query for follow-up questions"""
+    session = rag.sessions.create()
+    return SessionResponse(
+        session_id=session.id,
+        ttl_seconds=rag.sessions.ttl_seconds,
+        max_turns=rag.sessions.max_turns
+    )
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """End a conversation session and free its cached context"""
+    if not rag.sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return {"message": "Session deleted"}
+
+@app.get("/metrics")
+async def metrics():
+    """Expose Prometheus metrics"""
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
 @app.get("/status")
-async def get_status():
-    """Get system status"""
+async def get_status(request: Request):
+    """Get system status, served from memory; supports If-None-Match"""
     try:
-        # Check if database exists
-        db_exists = os.path.exists(rag.chroma_dir)
-        
-        # Get list of ingested repos
-        ingested_repos = []
-        if hasattr(ingestor, 'list_ingested_repos'):
-            ingested_repos = ingestor.list_ingested_repos()
+        stats = rag.status.snapshot()
+        sessions = rag.sessions.stats()
+        sessions.pop("active_sessions")
         
-        return {
-            "database_exists": db_exists,
-            "ingested_repositories": ingested_repos,
-            "total_repos": len(ingested_repos)
+        payload = {
+            "database_exists": stats["database_exists"],
+            "ingested_repositories": [repo["url"] for repo in stats["repos"]],
+            "total_repos": len(stats["repos"]),
+            "repositories": stats["repos"],
+            "index_size_bytes": stats["index_size_bytes"],
+            "sessions": sessions
         }
+        
+        # The ETag is a hash of the payload, so it changes exactly when the status does.
+        # Only state shared by all workers is included, so any worker returns the same ETag;
+        # per-process index state and counters are served by /status/live.
+        body = json.dumps(payload, sort_keys=True, default=str)
+        etag = '"' + hashlib.md5(body.encode("utf-8")).hexdigest() + '"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        
+        if request.headers.get("if-none-match") == etag:
+            CACHE_HITS.labels(cache="status_etag").inc()
+            return Response(status_code=304, headers=headers)
+        
+        return JSONResponse(content=json.loads(body), headers=headers)
     except Exception as e:
         print(f"Error in get_status: {str(e)}")
         return {
@@ -139,19 +240,20 @@ async def get_status():
             "error": str(e)
         }
 
+@app.get("/status/live")
+async def get_live_status():
+    """This worker's index residency and counters (hits, loads, active sessions); not cached"""
+    return {
+        "indexes": rag.index_manager.status(),
+        "sessions": rag.sessions.stats()
+    }
+
 @app.delete("/reset")
 async def reset_database():
     """Reset the entire database"""
     try:
-        import shutil
-        
-        # Remove chroma database
-        if os.path.exists(rag.chroma_dir):
-            shutil.rmtree(rag.chroma_dir)
-        
-        # Remove processed files tracking
-        if os.path.exists(rag.processed_files_path):
-            os.remove(rag.processed_files_path)
+        # Takes the store write lock, so in-flight queries and ingests finish first
+        await run_in_threadpool(rag.reset)
         
         return {"message": "Database reset successfully"}
         
@@ -159,6 +261,60 @@ async def reset_database():
         print(f"Error in reset_database: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to reset database: {str(e)}")
 
+@app.get("/snapshot")
+async def export_snapshot():
+    """Download a versioned snapshot of the knowledge base for bootstrapping replicas"""
+    fd, snapshot_path = tempfile.mkstemp(prefix="gitoracle-snapshot-", suffix=".tar.gz")
+    os.close(fd)
+    try:
+        manifest = await run_in_threadpool(rag.export_snapshot, snapshot_path)
+        
+        # The temp file is removed once the response has been streamed
+        return FileResponse(
+            snapshot_path,
+            media_type="application/gzip",
+            filename=f"gitoracle-snapshot-v{manifest['format_version']}.tar.gz",
+            background=BackgroundTask(os.remove, snapshot_path)
+        )
+        
+    except ValueError as e:
+        os.remove(snapshot_path)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        os.remove(snapshot_path)
+        print(f"Error in export_snapshot: {str(e)}")
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Failed to export snapshot: {str(e)}")
+
+@app.post("/snapshot")
+async def import_snapshot(file: UploadFile = File(...), force: bool = False):
+    """Replace the knowledge base with an uploaded snapshot, without re-embedding"""
+    fd, snapshot_path = tempfile.mkstemp(prefix="gitoracle-snapshot-", suffix=".tar.gz")
+    try:
+        # Snapshots can be hundreds of MB; the copy must not block the event loop
+        def save_upload():
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(file.file, f)
+        await run_in_threadpool(save_upload)
+        
+        manifest = await run_in_threadpool(rag.import_snapshot, snapshot_path, force)
+        
+        return {
+            "message": "Snapshot imported successfully",
+            "vector_count": manifest["vector_count"],
+            "embedding_model": manifest["embedding_model"],
+            "created_at": manifest["created_at"]
+        }
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error in import_snapshot: {str(e)}")
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Failed to import snapshot: {str(e)}")
+    finally:
+        os.remove(snapshot_path)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
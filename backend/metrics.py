@@ -0,0 +1,79 @@
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Buckets cover everything from a cached lookup (~1ms) to a full repo fetch (minutes)
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_LATENCY = Histogram(
+    "gitoracle_stage_seconds",
+    "Time spent in each ingest and query stage",
+    ["stage"],
+    buckets=STAGE_BUCKETS
+)
+CHUNKS_EMBEDDED = Counter(
+    "gitoracle_chunks_embedded_total",
+    "Chunks embedded and written to the vector store"
+)
+BYTES_INGESTED = Counter(
+    "gitoracle_bytes_ingested_total",
+    "Bytes of repository content fetched by the ingestor"
+)
+CACHE_HITS = Counter(
+    "gitoracle_cache_hits_total",
+    "Lookups served from a cache instead of recomputing",
+    ["cache"]
+)
+CACHE_MISSES = Counter(
+    "gitoracle_cache_misses_total",
+    "Lookups that missed a cache and had to recompute",
+    ["cache"]
+)
+QUERY_ROUTES = Counter(
+    "gitoracle_query_routes_total",
+    "Queries answered by each route (structural fast path or full RAG)",
+    ["route"]
+)
+QUERY_BATCH_SIZE = Histogram(
+    "gitoracle_query_batch_size",
+    "Number of queries embedded and searched together by the coalescer",
+    buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+INGEST_CHUNKS_PER_SECOND = Gauge(
+    "gitoracle_ingest_chunks_per_second",
+    "Embedding throughput of the most recent index write",
+    multiprocess_mode="mostrecent"
+)
+
+
+@contextmanager
+def timed(stage, timings=None):
+    """Time a block, record it in the stage histogram and optionally in a timings dict (ms)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.labels(stage=stage).observe(elapsed)
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0.0) + elapsed * 1000, 3)
+
+
+def render_metrics():
+    """Render metrics in the Prometheus text format, aggregating workers when multiprocess mode is on"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,28 +1,79 @@
 import os
+import math
+import time
+import uuid
+import io
 import hashlib
+import tarfile
+import tempfile
+import numpy as np
 from dotenv import load_dotenv
 from langchain_community.document_loaders import TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_chroma import Chroma
 from langchain_groq import ChatGroq
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema import Document
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
 from ingest import RepoIngestor 
+from metrics import timed, CHUNKS_EMBEDDED, CACHE_HITS, CACHE_MISSES, INGEST_CHUNKS_PER_SECOND, QUERY_BATCH_SIZE, QUERY_ROUTES
+from coalescer import QueryCoalescer
+from index_manager import RepoIndexManager, collection_name_for, open_client, close_client, write_repo_key, LEGACY_COLLECTION, STAGING_PREFIX
+from storage import StoreLock, atomic_write_json, atomic_write_text, normalize_key
+from sessions import SessionStore
+from status import StatusTracker, REPO_STATS_FILENAME, read_commit
+from tree_index import RepoTreeIndex, parse_tree, parse_content_headers, route_structural
 import json
+import threading
 
 load_dotenv()
 
 DATA_DIR = "data"
 CHROMA_DIR = "chroma"
 PROCESSED_FILES_PATH = "processed_files.json"
+EMBEDDING_MODEL = "sentence-transformers/all-mpnet-base-v2"
+LLM_MODEL = "llama3-70b-8192"
+
+# Retrieval defaults used when a caller does not override them
+DEFAULT_K = 5
+DEFAULT_FETCH_K = 20
+DEFAULT_MMR_LAMBDA = 0.5
+
+# Chunking defaults for split_doc_with_filenames
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 300
+
+# Number of chunks embedded per forward pass when building the index
+EMBED_BATCH_SIZE = 64
+
+# Concurrent queries arriving within QUERY_BATCH_MAX_WAIT_MS are embedded and searched together
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "16"))
+QUERY_BATCH_MAX_WAIT_MS = float(os.getenv("QUERY_BATCH_MAX_WAIT_MS", "5"))
+
+# Cached session chunks at least this relevant to a follow-up are reused instead of re-fetched
+SESSION_REUSE_MIN_SCORE = float(os.getenv("SESSION_REUSE_MIN_SCORE", "0.4"))
+
+# Estimated memory the resident repo indexes may use before cold repos are evicted
+INDEX_MEMORY_BUDGET_MB = int(os.getenv("INDEX_MEMORY_BUDGET_MB", "1024"))
+
+# Bumped whenever the snapshot archive layout changes
+SNAPSHOT_FORMAT_VERSION = 2
+SNAPSHOT_PAGE_SIZE = 1000
 
 class Rag:
-    def __init__(self, data_dir=DATA_DIR, chroma_dir=CHROMA_DIR):
+    def __init__(self, data_dir=DATA_DIR, chroma_dir=CHROMA_DIR, processed_files_path=PROCESSED_FILES_PATH,
+                 embeddings=None, llm=None, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                 batch_max_size=QUERY_BATCH_MAX_SIZE, batch_max_wait_ms=QUERY_BATCH_MAX_WAIT_MS,
+                 memory_budget_mb=INDEX_MEMORY_BUDGET_MB):
         self.data_dir = data_dir
         self.chroma_dir = chroma_dir
-        self.processed_files_path = PROCESSED_FILES_PATH
-        self.embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
+        self.processed_files_path = processed_files_path
+        # embeddings/llm can be injected (benchmarks, evaluation); defaults are the production models
+        self.embeddings = embeddings or HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+        self.embedding_model = getattr(self.embeddings, "model_name", type(self.embeddings).__name__)
+        self.llm = llm
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
         self.prompt_template = """
 Answer the question about the codebase based on the context provided. Pay special attention to the file names mentioned in the context.
 
@@ -33,22 +84,58 @@ Question: {question}
 
 Please provide a detailed answer based on the context above. If you're discussing specific files, mention their names clearly.
 """
+        self.session_prompt_template = """
+Answer the question about the codebase based on the conversation so far and the context provided. Pay special attention to the file names mentioned in the context.
+
+Conversation so far:
+{history}
+
+Context:
+{context}
+
+Question: {question}
+
+Please provide a detailed answer based on the context above. If the question refers to something discussed earlier, use the conversation to resolve it. If you're discussing specific files, mention their names clearly.
+"""
+        # Server-side conversations, so follow-ups can reuse already retrieved context
+        self.sessions = SessionStore()
+        # Guards the vector store and the manifest across threads and worker processes.
+        # The lock file lives next to the store so /reset can delete the store itself.
+        self.lock = StoreLock(os.path.abspath(self.chroma_dir) + ".lock")
         self.processed_files = self.load_processed_files()
+        # Per-repo statistics served by /status from memory, shared with other workers via a file next to the manifest
+        self.status = StatusTracker(os.path.join(os.path.dirname(self.processed_files_path), REPO_STATS_FILENAME))
+        self.status.bootstrap(self.processed_files, os.path.exists(self.chroma_dir))
+        # Path/tree index per repo key, for structural questions answered without the LLM
+        self.tree_indexes = {}
+        self._tree_lock = threading.Lock()
+        # One collection per repo, loaded on first query and evicted when cold
+        self.index_manager = RepoIndexManager(self.chroma_dir, self.embeddings, memory_budget_mb * 1024 * 1024)
+        self.query_coalescer = QueryCoalescer(
+            self.retrieve_batch,
+            max_batch_size=batch_max_size,
+            max_wait_ms=batch_max_wait_ms,
+            on_batch=QUERY_BATCH_SIZE.observe
+        )
+
+    def close(self):
+        """Stop the query batching worker (benchmarks and evaluation create many Rag instances)"""
+        self.query_coalescer.close()
 
     def load_processed_files(self):
         """Load the list of already processed files"""
         if os.path.exists(self.processed_files_path):
             try:
                 with open(self.processed_files_path, 'r') as f:
-                    return json.load(f)
+                    # Older manifests were written on Windows with "data\\..." keys
+                    return {normalize_key(path): file_hash for path, file_hash in json.load(f).items()}
             except:
                 return {}
         return {}
 
     def save_processed_files(self):
-        """Save the list of processed files"""
-        with open(self.processed_files_path, 'w') as f:
-            json.dump(self.processed_files, f)
+        """Save the list of processed files (atomically, so readers never see a partial manifest)"""
+        atomic_write_json(self.processed_files_path, self.processed_files)
 
     def get_file_hash(self, filepath):
         """Generate hash of file content to detect changes"""
@@ -58,6 +145,14 @@ Please provide a detailed answer based on the context above. If you're discussin
         except:
             return None
 
+    def repo_key(self, url):
+        """Manifest key (and index identity) of a repo's dump"""
+        return normalize_key(self.get_file(url))
+
+    def has_repo(self, url):
+        """Whether a repo has its own index in the store"""
+        return bool(self.index_manager.collections_for(self.repo_key(url)))
+
     def get_file(self, url):
         ingestor = RepoIngestor()
         filename = ingestor.get_filename(url)
@@ -79,39 +174,41 @@ Please provide a detailed answer based on the context above. If you're discussin
             content = doc.page_content
             
             # Split by common file separators or patterns
-            file_sections = self.parse_files_from_content(content)
+            with timed("parse"):
+                file_sections = self.parse_files_from_content(content)
             
             if not file_sections:
                 # Fallback: treat as single document
                 file_sections = [{"filename": "unknown", "content": content}]
             
-            for section in file_sections:
-                filename = section["filename"]
-                file_content = section["content"]
-                
-                splitter = RecursiveCharacterTextSplitter(
-                    chunk_size=1000,
-                    chunk_overlap=300,
-                    length_function=len,
-                    add_start_index=True
-                )
-                
-                # Create a temporary document for splitting
-                temp_doc = Document(
-                    page_content=file_content,
-                    metadata={"source": filename, "original_source": doc.metadata.get("source", "")}
-                )
-                
-                chunks = splitter.split_documents([temp_doc])
-                
-                # Add filename to each chunk's metadata
-                for chunk in chunks:
-                    chunk.metadata["filename"] = filename
-                    chunk.metadata["file_type"] = self.get_file_type(filename)
-                    # Add filename context to the beginning of chunk content
-                    chunk.page_content = f"[File: {filename}]\n\n{chunk.page_content}"
-                
-                all_chunks.extend(chunks)
+            with timed("split"):
+                for section in file_sections:
+                    filename = section["filename"]
+                    file_content = section["content"]
+                    
+                    splitter = RecursiveCharacterTextSplitter(
+                        chunk_size=self.chunk_size,
+                        chunk_overlap=self.chunk_overlap,
+                        length_function=len,
+                        add_start_index=True
+                    )
+                    
+                    # Create a temporary document for splitting
+                    temp_doc = Document(
+                        page_content=file_content,
+                        metadata={"source": filename, "original_source": doc.metadata.get("source", "")}
+                    )
+                    
+                    chunks = splitter.split_documents([temp_doc])
+                    
+                    # Add filename to each chunk's metadata
+                    for chunk in chunks:
+                        chunk.metadata["filename"] = filename
+                        chunk.metadata["file_type"] = self.get_file_type(filename)
+                        # Add filename context to the beginning of chunk content
+                        chunk.page_content = f"[File: {filename}]\n\n{chunk.page_content}"
+                    
+                    all_chunks.extend(chunks)
         
         print(f"Split into {len(all_chunks)} chunks across multiple files")
         return all_chunks
@@ -177,40 +274,92 @@ Please provide a detailed answer based on the context above. If you're discussin
             return ext
         return "unknown"
     
+    def embed_chunks(self, chunks):
+        """Embed chunks in batches; runs outside the store lock so readers are not blocked"""
+        vectors = []
+        for start in range(0, len(chunks), EMBED_BATCH_SIZE):
+            texts = [chunk.page_content for chunk in chunks[start:start + EMBED_BATCH_SIZE]]
+            with timed("embed_batch"):
+                vectors.extend(np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32))
+        return vectors
+
+    def write_chunks(self, chunks, vectors, repo_key, replace=False):
+        """Write pre-embedded chunks to the repo's collection; the caller must hold the write lock"""
+        collection_name = collection_name_for(repo_key)
+        existed = os.path.exists(self.chroma_dir)
+
+        existing = self.index_manager.list_collections()
+        if replace and collection_name in existing:
+            # Drop the previous version of the same dump so re-ingest does not duplicate chunks
+            self.index_manager.delete(collection_name)
+        if LEGACY_COLLECTION in existing:
+            self.remove_legacy_chunks(repo_key)
+
+        db = self.get_db(collection_name, repo_key=repo_key)
+        print("Loaded existing Chroma DB." if existed else "Creating new Chroma DB.")
+
+        for start in range(0, len(chunks), EMBED_BATCH_SIZE):
+            batch = chunks[start:start + EMBED_BATCH_SIZE]
+            with timed("chroma_write"):
+                db._collection.add(
+                    ids=[str(uuid.uuid4()) for _ in batch],
+                    embeddings=[vector.tolist() for vector in vectors[start:start + EMBED_BATCH_SIZE]],
+                    documents=[chunk.page_content for chunk in batch],
+                    metadatas=[chunk.metadata for chunk in batch]
+                )
+            CHUNKS_EMBEDDED.inc(len(batch))
+
+        self.index_manager.register(collection_name, repo_key)
+        return db._collection.count()
+
+    def remove_legacy_chunks(self, repo_key):
+        """Delete a repo's chunks from the old single collection once it gets its own; the caller must hold the write lock"""
+        legacy = self.index_manager.get_collection(LEGACY_COLLECTION)
+        # Chunks indexed on Windows recorded backslash paths as their source
+        legacy.delete(where={"original_source": {"$in": [repo_key, repo_key.replace("/", "\\")]}})
+        if legacy.count() == 0:
+            self.index_manager.delete(LEGACY_COLLECTION)
+        else:
+            # Its size estimate is stale; reopened on the next query
+            self.index_manager.register(LEGACY_COLLECTION, "legacy")
+
     def create_db(self, chunks):
         try:
-            # Test embeddings
-            _ = self.embeddings.embed_query("test")  
+            if not chunks:
+                print("No chunks to store.")
+                return False
 
-            if os.path.exists(self.chroma_dir):
-                # Load existing db
-                db = Chroma(
-                    embedding_function=self.embeddings,
-                    persist_directory=self.chroma_dir
-                )
-                print("Loaded existing Chroma DB.")
-                
-                # Add new chunks
-                db.add_documents(chunks)
-                print(f"Added {len(chunks)} new chunks to the vector DB.")
-            else:
-                # Create new db
-                db = Chroma.from_documents(
-                    documents=chunks,
-                    embedding=self.embeddings,
-                    persist_directory=self.chroma_dir
-                )
-                print(f"Created new Chroma DB with {len(chunks)} chunks.")
+            started = time.perf_counter()
+            vectors = self.embed_chunks(chunks)
+            repo_key = normalize_key(chunks[0].metadata.get("original_source", ""))
+            with self.lock.write():
+                self.write_chunks(chunks, vectors, repo_key)
+
+            elapsed = time.perf_counter() - started
+            if elapsed > 0:
+                INGEST_CHUNKS_PER_SECOND.set(len(chunks) / elapsed)
+            print(f"Added {len(chunks)} new chunks to the vector DB in {elapsed:.2f}s.")
 
             return True
 
         except Exception as e:
             print(f"Error with vector DB: {str(e)}")
             return False
+
+    def is_processed(self, key, file_hash):
+        """
+        Check the on-disk manifest, which other workers may have updated since we loaded it,
+        and that the repo really has its own collection (not just legacy or missing vectors)
+        """
+        self.processed_files = self.load_processed_files()
+        if self.processed_files.get(key) != file_hash:
+            return False
+        return bool(self.index_manager.collections_for(key))
         
     def train(self, url):
         """Train the model, but skip if file already processed and unchanged"""
         file_path = self.get_file(url)
+        key = self.repo_key(url)
         
         # Check if file exists
         if not os.path.exists(file_path):
@@ -219,70 +368,622 @@ Please provide a detailed answer based on the context above. If you're discussin
         
         # Check if file already processed
         file_hash = self.get_file_hash(file_path)
-        if file_path in self.processed_files and self.processed_files[file_path] == file_hash:
+        with self.lock.read():
+            already_processed = self.is_processed(key, file_hash)
+        if already_processed:
+            CACHE_HITS.labels(cache="processed_files").inc()
             print(f"File {file_path} already processed and unchanged. Skipping.")
             return True
+        CACHE_MISSES.labels(cache="processed_files").inc()
         
         # Load and process document
-        doc = self.load_doc(file_path)
+        with timed("load_doc"):
+            doc = self.load_doc(file_path)
         if not doc:
             print("No doc for training")
             return False
         
         # Split with filename preservation
         chunks = self.split_doc_with_filenames(doc)
-        
-        # Create/update database
-        success = self.create_db(chunks)
-        
-        if success:
-            # Mark file as processed
-            self.processed_files[file_path] = file_hash
-            self.save_processed_files()
+        if not chunks:
+            print("No chunks to store.")
+            return False
+
+        try:
+            # Embedding is the slow part, so it happens before taking the write lock
+            started = time.perf_counter()
+            vectors = self.embed_chunks(chunks)
+
+            with self.lock.write():
+                # Another worker may have finished the same dump while we were embedding
+                if self.is_processed(key, file_hash):
+                    CACHE_HITS.labels(cache="processed_files").inc()
+                    print(f"File {file_path} was processed concurrently. Skipping.")
+                    return True
+
+                vector_count = self.write_chunks(chunks, vectors, key, replace=key in self.processed_files)
+
+                # Mark file as processed
+                self.processed_files[key] = file_hash
+                self.save_processed_files()
+                self.status.update_index_size(self.chroma_dir)
+
+            self.load_tree_index(key, rebuild=True)
+            self.status.update_repo(
+                key,
+                url=url,
+                files=len({chunk.metadata["filename"] for chunk in chunks}),
+                chunks=len(chunks),
+                bytes=os.path.getsize(file_path),
+                vectors=vector_count,
+                commit=read_commit(file_path),
+                train_seconds=round(time.perf_counter() - started, 3)
+            )
+
+            elapsed = time.perf_counter() - started
+            if elapsed > 0:
+                INGEST_CHUNKS_PER_SECOND.set(len(chunks) / elapsed)
             print(f"Successfully processed and stored: {file_path}")
-        
-        return success
+            return True
+
+        except Exception as e:
+            print(f"Error with vector DB: {str(e)}")
+            return False
+
+    def load_tree_index(self, repo_key, rebuild=False):
+        """Build (or return the cached) path index of a repo from its tree dump, or its file headers; None if it has neither"""
+        with self._tree_lock:
+            if repo_key in self.tree_indexes and not rebuild:
+                return self.tree_indexes[repo_key]
+
+        content_path = repo_key
+        tree_path = content_path[:-len("_content.txt")] + "_tree.txt"
+        paths = []
+        with timed("tree_index_build"):
+            if os.path.exists(tree_path):
+                with open(tree_path, "r", encoding="utf-8") as f:
+                    paths = parse_tree(f.read())
+            if not paths and os.path.exists(content_path):
+                with open(content_path, "r", encoding="utf-8") as f:
+                    paths = parse_content_headers(f.read())
+
+        index = None
+        if paths:
+            name = os.path.basename(content_path)[:-len("_content.txt")]
+            index = RepoTreeIndex(repo_key, paths, name=name)
+        # Misses are cached too, so queries do not re-check the disk for repos without dumps
+        with self._tree_lock:
+            self.tree_indexes[repo_key] = index
+        return index
+
+    def get_tree_indexes(self, repo=None):
+        """Tree indexes for one repo, or for every processed repo"""
+        keys = [self.repo_key(repo)] if repo else list(self.processed_files)
+        indexes = [self.load_tree_index(key) for key in keys]
+        return [index for index in indexes if index is not None]
+
+    def reset(self):
+        """Delete the vector store and manifest while no reader or writer is active"""
+        import shutil
+
+        with self.lock.write():
+            # Close every repo store's client first, so nothing keeps the deleted files open
+            self.index_manager.forget()
+            if os.path.exists(self.chroma_dir):
+                shutil.rmtree(self.chroma_dir)
+
+            if os.path.exists(self.processed_files_path):
+                os.remove(self.processed_files_path)
+            self.processed_files = {}
+            self.tree_indexes = {}
+            # Cached session chunks point into the deleted store
+            self.sessions.clear()
+            self.status.clear()
+
+    def export_snapshot(self, snapshot_path, include_data=True):
+        """
+        Write a versioned snapshot of the knowledge base to a .tar.gz archive.
+
+        For every repo collection the archive holds the vectors (vectors.npy) and
+        chunk ids/documents/metadata (records.jsonl); manifest.json carries the
+        processed_files manifest and the embedding model id. The repo dumps and
+        trees from data/ are included optionally, so a replica can serve queries
+        without re-embedding. Taken under the read lock, so it is consistent.
+        """
+        with self.lock.read():
+            if not os.path.exists(self.chroma_dir):
+                raise ValueError("No knowledge base to export.")
+
+            self.index_manager.refresh(force=True)
+            manifest = {
+                "format_version": SNAPSHOT_FORMAT_VERSION,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "embedding_model": self.embedding_model,
+                "vector_count": 0,
+                "collections": [],
+                "processed_files": self.load_processed_files(),
+                "data_files": [],
+            }
+
+            payloads = {}
+            for collection_name in self.index_manager.collections_for():
+                ids, documents, metadatas, vectors = [], [], [], []
+                # Pinned, so a concurrent query evicting this repo does not close its store mid-export
+                with self.index_manager.using(collection_name) as db:
+                    collection = db._collection
+                    collection_metadata = collection.metadata
+                    for offset in range(0, collection.count(), SNAPSHOT_PAGE_SIZE):
+                        page = collection.get(
+                            limit=SNAPSHOT_PAGE_SIZE,
+                            offset=offset,
+                            include=["embeddings", "documents", "metadatas"]
+                        )
+                        ids.extend(page["ids"])
+                        documents.extend(page["documents"])
+                        metadatas.extend(page["metadatas"])
+                        vectors.extend(page["embeddings"])
+                if not ids:
+                    continue
+
+                matrix = np.asarray(vectors, dtype=np.float32)
+                vector_buffer = io.BytesIO()
+                np.save(vector_buffer, matrix)
+                records = "".join(
+                    json.dumps({"id": chunk_id, "document": document, "metadata": metadata}) + "\n"
+                    for chunk_id, document, metadata in zip(ids, documents, metadatas)
+                )
+                payloads[f"collections/{collection_name}/records.jsonl"] = records.encode("utf-8")
+                payloads[f"collections/{collection_name}/vectors.npy"] = vector_buffer.getvalue()
+
+                manifest["collections"].append({
+                    "name": collection_name,
+                    "metadata": collection_metadata,
+                    "vector_count": len(ids),
+                    "embedding_dim": int(matrix.shape[1]),
+                })
+                manifest["vector_count"] += len(ids)
+
+            data_files = []
+            if include_data and os.path.isdir(self.data_dir):
+                data_files = sorted(
+                    f for f in os.listdir(self.data_dir)
+                    if f.endswith("_content.txt") or f.endswith("_tree.txt")
+                )
+                manifest["data_files"] = data_files
+
+            snapshot_dir = os.path.dirname(os.path.abspath(snapshot_path))
+            fd, tmp_path = tempfile.mkstemp(dir=snapshot_dir, prefix=".tmp-", suffix=".tar.gz")
+            os.close(fd)
+            try:
+                with tarfile.open(tmp_path, "w:gz", compresslevel=1) as tar:
+                    self._add_bytes(tar, "manifest.json", json.dumps(manifest, indent=2).encode("utf-8"))
+                    for name, payload in payloads.items():
+                        self._add_bytes(tar, name, payload)
+                    for filename in data_files:
+                        tar.add(os.path.join(self.data_dir, filename), arcname=f"data/{filename}")
+                os.replace(tmp_path, snapshot_path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+        print(f"Exported snapshot with {manifest['vector_count']} vectors to {snapshot_path}")
+        return manifest
+
+    def _add_bytes(self, tar, name, payload):
+        info = tarfile.TarInfo(name)
+        info.size = len(payload)
+        info.mtime = int(time.time())
+        tar.addfile(info, io.BytesIO(payload))
+
+    def import_snapshot(self, snapshot_path, force=False):
+        """
+        Replace the knowledge base with a snapshot created by export_snapshot (no re-embedding).
+
+        The repo stores are built in a staging directory and only swapped in once every
+        record was written, so a failed import leaves the current store as it was.
+        """
+        import shutil
+
+        with tarfile.open(snapshot_path, "r:gz") as tar:
+            manifest = json.load(tar.extractfile("manifest.json"))
+
+            if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+                raise ValueError(
+                    f"Unsupported snapshot format {manifest.get('format_version')}, "
+                    f"expected {SNAPSHOT_FORMAT_VERSION}"
+                )
+            if manifest.get("embedding_model") != self.embedding_model and not force:
+                raise ValueError(
+                    f"Snapshot was built with {manifest.get('embedding_model')} "
+                    f"but this node embeds queries with {self.embedding_model}"
+                )
+
+            collections = []
+            for entry in manifest.get("collections", []):
+                prefix = f"collections/{entry['name']}"
+                records = [
+                    json.loads(line)
+                    for line in tar.extractfile(f"{prefix}/records.jsonl").read().decode("utf-8").splitlines()
+                    if line
+                ]
+                vectors = np.load(io.BytesIO(tar.extractfile(f"{prefix}/vectors.npy").read()))
+                if len(records) != len(vectors) or len(records) != entry["vector_count"]:
+                    raise ValueError(f"Snapshot is corrupt: record and vector counts differ for {entry['name']}")
+                collections.append((entry, records, vectors))
+
+            data_files = {}
+            for filename in manifest.get("data_files", []):
+                # Only plain file names are allowed, never paths out of data/
+                if os.path.basename(filename) != filename:
+                    raise ValueError(f"Invalid data file name in snapshot: {filename}")
+                data_files[filename] = tar.extractfile(f"data/{filename}").read().decode("utf-8")
+
+        with self.lock.write():
+            os.makedirs(self.chroma_dir, exist_ok=True)
+            # Left behind by an import that failed before cleaning up
+            for name in os.listdir(self.chroma_dir):
+                if name.startswith(STAGING_PREFIX):
+                    shutil.rmtree(os.path.join(self.chroma_dir, name), ignore_errors=True)
+
+            # Build every repo store in a staging directory first, so a failure leaves the current store untouched
+            staging_dir = os.path.join(self.chroma_dir, STAGING_PREFIX + uuid.uuid4().hex[:8])
+            try:
+                for entry, records, vectors in collections:
+                    store_path = os.path.join(staging_dir, entry["name"])
+                    client = open_client(store_path)
+                    try:
+                        collection = client.create_collection(entry["name"], metadata=entry.get("metadata"))
+                        for start in range(0, len(records), EMBED_BATCH_SIZE * 16):
+                            batch = records[start:start + EMBED_BATCH_SIZE * 16]
+                            collection.add(
+                                ids=[record["id"] for record in batch],
+                                embeddings=vectors[start:start + len(batch)].tolist(),
+                                documents=[record["document"] for record in batch],
+                                metadatas=[record["metadata"] for record in batch]
+                            )
+                    finally:
+                        close_client(client)
+                    repo_key = (entry.get("metadata") or {}).get("repo_key")
+                    write_repo_key(store_path, repo_key or ("legacy" if entry["name"] == LEGACY_COLLECTION else entry["name"]))
+            except Exception:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+                raise
+
+            # Everything was written: swap the staged stores in
+            os.makedirs(staging_dir, exist_ok=True)
+            self.index_manager.replace_all(staging_dir)
+
+            for filename, text in data_files.items():
+                atomic_write_text(os.path.join(self.data_dir, filename), text)
+
+            self.processed_files = {
+                normalize_key(path): file_hash
+                for path, file_hash in manifest.get("processed_files", {}).items()
+            }
+            self.save_processed_files()
+            # Rebuilt lazily from the imported tree dumps
+            self.tree_indexes = {}
+            self.sessions.clear()
+
+            self.status.clear()
+            self.status.bootstrap(self.processed_files, True)
+            self.status.update_index_size(self.chroma_dir)
+            for entry, _, _ in collections:
+                repo_key = (entry.get("metadata") or {}).get("repo_key")
+                if repo_key:
+                    self.status.update_repo(repo_key, vectors=entry["vector_count"])
+
+        print(f"Imported snapshot with {manifest['vector_count']} vectors from {snapshot_path}")
+        return manifest
     
-    def search_and_answer(self, query_text, k=5):
+    def get_db(self, collection_name, repo_key=None):
+        """Open one repo's collection in the persisted vector store"""
+        return self.index_manager.open(collection_name, repo_key=repo_key)
+
+    def resolve_retrieval_options(self, k=DEFAULT_K, fetch_k=None, use_mmr=False,
+                                  mmr_lambda=DEFAULT_MMR_LAMBDA, score_threshold=None,
+                                  max_context_chars=None, repo=None, with_embeddings=False):
+        """Normalise retrieval options so the response can report exactly what was used"""
+        k = max(1, int(k))
+        if fetch_k is None:
+            # MMR and score filtering need a wider candidate pool than k to be useful
+            fetch_k = max(k, DEFAULT_FETCH_K) if use_mmr or score_threshold is not None else k
+        fetch_k = max(k, int(fetch_k))
+
+        return {
+            "k": k,
+            "fetch_k": fetch_k,
+            "use_mmr": bool(use_mmr),
+            "mmr_lambda": float(mmr_lambda),
+            "score_threshold": score_threshold,
+            "max_context_chars": max_context_chars,
+            "repo": repo,
+            "with_embeddings": bool(with_embeddings),
+        }
+
+    def relevance_score(self, distance):
+        """Convert a Chroma L2 distance into a relevance score (same formula langchain uses)"""
+        return 1.0 - distance / math.sqrt(2)
+
+    def retrieve(self, query_text, options, timings=None, query_embedding=None):
+        """Fetch candidate chunks for a query and select the final k according to options"""
+        chunks, _ = self.retrieve_with_embedding(query_text, options, timings=timings, query_embedding=query_embedding)
+        return chunks
+
+    def retrieve_with_embedding(self, query_text, options, timings=None, query_embedding=None):
+        """Like retrieve, but also return the query embedding; options=None only embeds (still batched)"""
+        chunks, batch_timings, query_embedding = self.query_coalescer.run((query_text, options, query_embedding))
+        if timings is not None:
+            for stage, elapsed in batch_timings.items():
+                timings[stage] = round(timings.get(stage, 0.0) + elapsed, 3)
+        return chunks, query_embedding
+
+    def retrieve_batch(self, requests):
+        """
+        Embed and search several (query_text, options, query_embedding) requests with one
+        forward pass and one query per repo index. Returns (chunks, timings, query_embedding)
+        per request; requests without options are embedded but not searched.
+        """
+        timings = {}
+        query_embeddings = [query_embedding for _, _, query_embedding in requests]
+        missing = [i for i, query_embedding in enumerate(query_embeddings) if query_embedding is None]
+
+        if missing:
+            with timed("query_embedding", timings):
+                if len(missing) == 1:
+                    computed = [self.embeddings.embed_query(requests[missing[0]][0])]
+                else:
+                    computed = self.embeddings.embed_documents([requests[i][0] for i in missing])
+            for i, query_embedding in zip(missing, computed):
+                query_embeddings[i] = query_embedding
+
+        searches = [i for i, (_, options, _) in enumerate(requests) if options is not None]
+        if not searches:
+            return [([], dict(timings), query_embedding) for query_embedding in query_embeddings]
+
+        include = ["documents", "metadatas", "distances"]
+        if any(requests[i][1]["use_mmr"] or requests[i][1]["with_embeddings"] for i in searches):
+            include.append("embeddings")
+
+        candidates = [[] for _ in requests]
+        with timed("similarity_search", timings), self.lock.read():
+            # Group requests by the repo indexes they target so each index is queried once
+            groups = {}
+            for i in searches:
+                options = requests[i][1]
+                repo_key = self.repo_key(options["repo"]) if options["repo"] else None
+                targets = self.index_manager.search_targets(repo_key)
+                options["indexes_searched"] = len(targets)
+                for collection_name in targets:
+                    groups.setdefault(collection_name, []).append(i)
+
+            for collection_name, indices in groups.items():
+                db = self.index_manager.acquire(collection_name, dim=len(query_embeddings[0]))
+                if db is None:
+                    continue
+                results = db._collection.query(
+                    query_embeddings=[query_embeddings[i] for i in indices],
+                    n_results=max(requests[i][1]["fetch_k"] for i in indices),
+                    include=include
+                )
+                for position, i in enumerate(indices):
+                    candidates[i].extend(self.candidates_from_results(results, position, requests[i][1]["fetch_k"]))
+
+            selected = [
+                self.select_chunks(query_embeddings[i], candidates[i], options) if options is not None else []
+                for i, (_, options, _) in enumerate(requests)
+            ]
+
+        for i in searches:
+            requests[i][1]["batch_size"] = len(requests)
+        return [(chunks, dict(timings), query_embedding) for chunks, query_embedding in zip(selected, query_embeddings)]
+
+    def candidates_from_results(self, results, index, fetch_k):
+        """Turn one query's raw Chroma results into scored candidate dicts"""
+        candidates = []
+        # The batch may have fetched more candidates than this request asked for
+        ids = results["ids"][index][:fetch_k]
+        embeddings = results.get("embeddings")
+        for i, chunk_id in enumerate(ids):
+            candidates.append({
+                "id": chunk_id,
+                "content": results["documents"][index][i],
+                "metadata": results["metadatas"][index][i] or {},
+                "score": self.relevance_score(results["distances"][index][i]),
+                "embedding": embeddings[index][i] if embeddings is not None else None,
+            })
+        return candidates
+
+    def select_chunks(self, query_embedding, candidates, options):
+        """Apply score threshold and MMR to a query's candidates (possibly merged from several repos)"""
+        candidates = sorted(candidates, key=lambda c: c["score"], reverse=True)[:options["fetch_k"]]
+
+        if options["score_threshold"] is not None:
+            candidates = [c for c in candidates if c["score"] >= options["score_threshold"]]
+
+        if options["use_mmr"] and candidates:
+            selected = maximal_marginal_relevance(
+                np.array(query_embedding, dtype=np.float32),
+                [c["embedding"] for c in candidates],
+                lambda_mult=options["mmr_lambda"],
+                k=options["k"]
+            )
+            candidates = [candidates[i] for i in selected]
+
+        return candidates[:options["k"]]
+
+    def retrieve_with_session(self, query_text, options, turns, cached_chunks, timings):
+        """Reuse chunks this session already retrieved; only search the store when they do not cover the question"""
+        # Follow-ups ("and how is that function called?") are embedded together with the previous question
+        retrieval_text = f"{turns[-1]['question']}\n{query_text}" if turns else query_text
+        # Embedded through the coalescer, so session queries share forward passes with the others
+        _, query_embedding = self.retrieve_with_embedding(retrieval_text, None, timings=timings)
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+
+        if options["use_mmr"]:
+            # MMR needs the full candidate pool, which the session cache does not have
+            cached_chunks = []
+        if options["repo"]:
+            # The session may hold chunks from other repos, retrieved by earlier unscoped or differently scoped turns
+            repo_key = self.repo_key(options["repo"])
+            cached_chunks = [
+                chunk for chunk in cached_chunks
+                if normalize_key(chunk["metadata"].get("original_source", "")) == repo_key
+            ]
+
+        min_score = options["score_threshold"] if options["score_threshold"] is not None else SESSION_REUSE_MIN_SCORE
+        reused = []
+        for chunk in cached_chunks:
+            distance = float(np.sum((chunk["embedding"] - query_embedding) ** 2))
+            score = self.relevance_score(distance)
+            if score >= min_score:
+                reused.append(dict(chunk, score=score))
+        reused.sort(key=lambda c: c["score"], reverse=True)
+        options["session_chunks_reused"] = min(len(reused), options["k"])
+
+        if len(reused) >= options["k"]:
+            CACHE_HITS.labels(cache="session_context").inc()
+            options["route"] = "session"
+            # Nothing was fetched from the store, so no candidate pool was used
+            options["fetch_k"] = None
+            return reused[:options["k"]]
+
+        CACHE_MISSES.labels(cache="session_context").inc()
+        fetched = self.retrieve(retrieval_text, options, timings=timings, query_embedding=query_embedding.tolist())
+        seen = {chunk["id"] for chunk in reused}
+        merged = reused + [chunk for chunk in fetched if chunk["id"] not in seen]
+        return sorted(merged, key=lambda c: c["score"], reverse=True)[:options["k"]]
+
+    def format_history(self, turns):
+        return "\n\n".join(f"Q: {turn['question']}\nA: {turn['answer']}" for turn in turns)
+
+    def build_context(self, chunks, max_context_chars=None):
+        """Join chunk contents into the prompt context, respecting an optional size cap"""
+        context_parts = []
+        used = []
+        total = 0
+        separator = "\n\n---\n\n"
+
+        for chunk in chunks:
+            content = chunk["content"]
+            if max_context_chars is not None:
+                remaining = max_context_chars - total - (len(separator) if context_parts else 0)
+                if remaining <= 0:
+                    break
+                if len(content) > remaining:
+                    # Only truncate the first chunk; otherwise stop at a chunk boundary
+                    if context_parts:
+                        break
+                    content = content[:remaining]
+            context_parts.append(content)
+            used.append(chunk)
+            total = len(separator.join(context_parts))
+
+        return separator.join(context_parts), used
+
+    def search_and_answer(self, query_text, k=DEFAULT_K, fetch_k=None, use_mmr=False,
+                          mmr_lambda=DEFAULT_MMR_LAMBDA, score_threshold=None,
+                          max_context_chars=None, repo=None, structural_routing=True, session_id=None):
         """Search the knowledge base and provide an answer - THIS IS THE METHOD THE API CALLS"""
+        session = self.sessions.get(session_id) if session_id else None
+        options = self.resolve_retrieval_options(
+            k=k,
+            fetch_k=fetch_k,
+            use_mmr=use_mmr,
+            mmr_lambda=mmr_lambda,
+            score_threshold=score_threshold,
+            max_context_chars=max_context_chars,
+            repo=repo,
+            # Session chunks keep their embeddings so later follow-ups can be matched against them
+            with_embeddings=session is not None
+        )
+
+        timings = {}
+        session_id = session.id if session else None
+        turns, cached_chunks = session.snapshot() if session else ([], [])
+
+        if structural_routing:
+            # Path, listing and file-type questions are answered from the tree index in milliseconds
+            with timed("structural_route", timings):
+                routed = route_structural(query_text, self.get_tree_indexes(repo))
+            if routed:
+                QUERY_ROUTES.labels(route="structural").inc()
+                options["route"] = f"structural:{routed['kind']}"
+                if session:
+                    session.add_turn(query_text, routed["response"], [])
+                return {
+                    "response": routed["response"],
+                    "sources": routed["sources"],
+                    "retrieval": options,
+                    "chunks": [],
+                    "timings": timings,
+                    "session_id": session_id
+                }
+        QUERY_ROUTES.labels(route="rag").inc()
+        options["route"] = "rag"
+
         if not os.path.exists(self.chroma_dir):
             print("Chroma DB not found. Train first.")
-            return {"response": "No knowledge base available.", "sources": []}
-        
-        db = Chroma(embedding_function=self.embeddings, persist_directory=self.chroma_dir)
+            return {"response": "No knowledge base available.", "sources": [], "retrieval": options, "chunks": [], "timings": timings, "session_id": session_id}
         
         # Search for similar documents
-        results = db.similarity_search(query_text, k=k)
+        if session:
+            results = self.retrieve_with_session(query_text, options, turns, cached_chunks, timings)
+        else:
+            results = self.retrieve(query_text, options, timings=timings)
         
         if not results:
-            return {"response": "No relevant information found.", "sources": []}
+            return {"response": "No relevant information found.", "sources": [], "retrieval": options, "chunks": [], "timings": timings, "session_id": session_id}
         
-        # Build context from results
-        context_parts = []
+        with timed("prompt_build", timings):
+            # Build context from results
+            context, used = self.build_context(results, options["max_context_chars"])
+
+            # Create and format prompt
+            if turns:
+                prompt_template = ChatPromptTemplate.from_template(self.session_prompt_template)
+                prompt = prompt_template.format(history=self.format_history(turns), context=context, question=query_text)
+            else:
+                prompt_template = ChatPromptTemplate.from_template(self.prompt_template)
+                prompt = prompt_template.format(context=context, question=query_text)
+        options["context_chars"] = len(context)
+        options["chunks_used"] = len(used)
+
         sources = []
-        
-        for doc in results:
-            context_parts.append(doc.page_content)
+        chunk_scores = []
+        for chunk in used:
             # Get filename from metadata
-            filename = doc.metadata.get("filename", "unknown")
-            source = doc.metadata.get("source", "unknown")
+            filename = chunk["metadata"].get("filename", "unknown")
+            source = chunk["metadata"].get("source", "unknown")
             sources.append(f"{filename} (from {source})")
-        
-        context = "\n\n---\n\n".join(context_parts)
-
-        # Create and format prompt
-        prompt_template = ChatPromptTemplate.from_template(self.prompt_template)
-        prompt = prompt_template.format(context=context, question=query_text)
+            chunk_scores.append({"filename": filename, "source": source, "score": chunk["score"]})
 
         # Get LLM response
-        llm = ChatGroq(model="llama3-70b-8192")  
-        response = llm.invoke(prompt)
+        with timed("llm_call", timings):
+            response = self.get_llm().invoke(prompt)
+
+        if session:
+            session.add_turn(query_text, response.content, [
+                dict(chunk, embedding=np.asarray(chunk["embedding"], dtype=np.float32))
+                for chunk in used if chunk["embedding"] is not None
+            ])
 
         return {
             "response": response.content,
-            "sources": list(set(sources))  # Remove duplicates
+            "sources": list(dict.fromkeys(sources)),  # Remove duplicates, keep score order
+            "retrieval": options,
+            "chunks": chunk_scores,
+            "timings": timings,
+            "session_id": session_id
         }
 
+    def get_llm(self):
+        """Return the chat model, creating the Groq client on first use"""
+        if self.llm is None:
+            self.llm = ChatGroq(model=LLM_MODEL)
+        return self.llm
+
     def interactive_query(self):
         """Interactive query loop for command line usage"""
         if not os.path.exists(self.chroma_dir):
@@ -320,7 +1021,11 @@ def main():
     
     rag = Rag()
     
-    if len(sys.argv) >= 2:
+    if len(sys.argv) >= 3 and sys.argv[1] == "--export-snapshot":
+        rag.export_snapshot(sys.argv[2].strip())
+    elif len(sys.argv) >= 3 and sys.argv[1] == "--import-snapshot":
+        rag.import_snapshot(sys.argv[2].strip(), force="--force" in sys.argv[3:])
+    elif len(sys.argv) >= 2:
         repo_url = sys.argv[1].strip()
         
         print(f"Training on repository: {repo_url}")
@@ -339,6 +1044,8 @@ def main():
             rag.interactive_query()
         else:
             print("Usage: python rag.py <github_repo_url>")
+            print("       python rag.py --export-snapshot <snapshot.tar.gz>")
+            print("       python rag.py --import-snapshot <snapshot.tar.gz> [--force]")
             print("Or run with existing database for interactive queries.")
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict, deque
+
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "6"))
+SESSION_MAX_CHUNKS = int(os.getenv("SESSION_MAX_CHUNKS", "20"))
+
+# Answers are kept for follow-up prompts only, so long ones are truncated
+MAX_ANSWER_CHARS = 2000
+
+
+class Session:
+    def __init__(self, session_id, max_turns, max_chunks):
+        self.id = session_id
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        self.turns = deque(maxlen=max_turns)
+        self.chunks = OrderedDict()  # chunk id -> chunk, least recently used first
+        self.max_chunks = max_chunks
+        self.lock = threading.Lock()
+
+    def add_turn(self, question, answer, chunks):
+        with self.lock:
+            self.turns.append({"question": question, "answer": answer[:MAX_ANSWER_CHARS]})
+            for chunk in chunks:
+                self.chunks[chunk["id"]] = chunk
+                self.chunks.move_to_end(chunk["id"])
+            while len(self.chunks) > self.max_chunks:
+                self.chunks.popitem(last=False)
+
+    def snapshot(self):
+        """Copies of the turns and chunks, safe to use outside the session lock"""
+        with self.lock:
+            return list(self.turns), list(self.chunks.values())
+
+
+class SessionStore:
+    """
+    Bounded in-memory store of conversation sessions.
+
+    Sessions expire after ttl_seconds without use, and once max_sessions is
+    reached the least recently used one is dropped, so memory stays bounded
+    no matter how many clients connect.
+    """
+
+    def __init__(self, max_sessions=SESSION_MAX, ttl_seconds=SESSION_TTL_SECONDS,
+                 max_turns=SESSION_MAX_TURNS, max_chunks=SESSION_MAX_CHUNKS):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_turns = max_turns
+        self.max_chunks = max_chunks
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_used >= cutoff:
+                break
+            self._sessions.pop(session_id)
+
+    def create(self):
+        with self._lock:
+            self._expire()
+            while len(self._sessions) >= self.max_sessions:
+                self._sessions.popitem(last=False)
+            session = Session(uuid.uuid4().hex, self.max_turns, self.max_chunks)
+            self._sessions[session.id] = session
+            return session
+
+    def get(self, session_id):
+        """Return a live session and mark it used, or None if unknown or expired"""
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.monotonic()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def stats(self):
+        with self._lock:
+            self._expire()
+            return {
+                "active_sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl_seconds,
+                "max_turns": self.max_turns,
+                "max_chunks": self.max_chunks,
+            }
@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from storage import StoreLock, atomic_write_json
+
+# Stored next to processed_files.json
+REPO_STATS_FILENAME = "repo_stats.json"
+
+
+def url_from_key(repo_key):
+    """Best-effort repo URL from a dump key (same reconstruction list_ingested_repos uses)"""
+    return os.path.basename(repo_key).replace('_content.txt', '').replace('_', '/')
+
+
+def read_commit(content_path):
+    """Commit id from the summary at the top of a dump (written by RepoIngestor), if it recorded one"""
+    try:
+        with open(content_path, "r", encoding="utf-8") as f:
+            for _ in range(20):
+                line = f.readline()
+                if not line or line.startswith("=== REPOSITORY STRUCTURE"):
+                    break
+                if line.startswith("Commit:"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return None
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class StatusTracker:
+    """
+    Per-repo statistics kept in memory and updated at ingest time.
+
+    /status is served from here without touching the index. The stats are shared
+    by all workers through repo_stats.json: updates re-read the file and write it
+    back under the file's own lock (never the store lock, so they do not wait for
+    queries), and reads reload it whenever another worker has replaced it.
+    """
+
+    def __init__(self, stats_path=REPO_STATS_FILENAME):
+        self.stats_path = stats_path
+        self.file_lock = StoreLock(stats_path + ".lock")
+        self._lock = threading.RLock()
+        self._signature = None
+        self.repos = {}
+        self.index_size_bytes = 0
+        self.database_exists = False
+        self.load()
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.stats_path)
+            return stat.st_ino, stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def load(self):
+        signature = self._file_signature()
+        if signature is None:
+            return
+        try:
+            with open(self.stats_path, "r") as f:
+                data = json.load(f)
+        except:
+            return
+        self.repos = data.get("repos", {})
+        self.index_size_bytes = data.get("index_size_bytes", 0)
+        self.database_exists = data.get("database_exists", self.database_exists)
+        self._signature = signature
+
+    def _state(self):
+        return json.dumps([self.repos, self.index_size_bytes, self.database_exists], sort_keys=True)
+
+    def save(self):
+        atomic_write_json(self.stats_path, {
+            "repos": self.repos,
+            "index_size_bytes": self.index_size_bytes,
+            "database_exists": self.database_exists,
+        })
+        self._signature = self._file_signature()
+
+    @contextmanager
+    def _update(self):
+        """Read-modify-write of the shared stats file, serialised across workers; only written if it changed"""
+        with self.file_lock.write(), self._lock:
+            self.load()
+            before = self._state()
+            yield
+            if self._state() != before or self._signature is None:
+                self.save()
+
+    def bootstrap(self, processed_files, database_exists):
+        """Seed stats for repos processed before tracking existed (one-off, at startup)"""
+        with self._lock:
+            if self.database_exists == database_exists and all(key in self.repos for key in processed_files):
+                # Already up to date: worker startup does not touch the file
+                return
+        with self._update():
+            self.database_exists = database_exists
+            for repo_key in processed_files:
+                if repo_key not in self.repos:
+                    self.repos[repo_key] = {
+                        "url": url_from_key(repo_key),
+                        "bytes": os.path.getsize(repo_key) if os.path.exists(repo_key) else None,
+                        "commit": read_commit(repo_key),
+                    }
+
+    def update_repo(self, repo_key, **fields):
+        with self._update():
+            entry = self.repos.setdefault(repo_key, {"url": url_from_key(repo_key)})
+            entry.update({name: value for name, value in fields.items() if value is not None})
+            entry["updated_at"] = time.time()
+
+    def update_index_size(self, chroma_dir):
+        """Measure the store on disk; called after index writes, never per request"""
+        with self._update():
+            self.database_exists = os.path.exists(chroma_dir)
+            self.index_size_bytes = directory_size(chroma_dir) if self.database_exists else 0
+
+    def clear(self):
+        with self._update():
+            self.repos = {}
+            self.index_size_bytes = 0
+            self.database_exists = False
+
+    def snapshot(self):
+        """Copy of the current stats; each repo's share of the on-disk index is apportioned by vector count"""
+        with self._lock:
+            if self._file_signature() != self._signature:
+                # Another worker ingested, reset or imported since we last looked
+                self.load()
+            total_vectors = sum(entry.get("vectors") or 0 for entry in self.repos.values())
+            repos = []
+            for repo_key, entry in sorted(self.repos.items()):
+                repo = dict(entry, key=repo_key)
+                if total_vectors and entry.get("vectors"):
+                    repo["index_size_bytes"] = int(self.index_size_bytes * entry["vectors"] / total_vectors)
+                repos.append(repo)
+            return {
+                "database_exists": self.database_exists,
+                "index_size_bytes": self.index_size_bytes,
+                "repos": repos,
+            }
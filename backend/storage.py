@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import posixpath
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+LOCK_POLL_INTERVAL = 0.05
+
+# Longest a reader or writer waits for the store before giving up (None waits forever)
+STORE_LOCK_TIMEOUT = float(os.getenv("STORE_LOCK_TIMEOUT_SECONDS", "300"))
+
+
+class StoreLock:
+    """
+    Cross-process single-writer / multi-reader lock backed by a lock file.
+
+    Readers take a shared lock and writers an exclusive one, so any number of
+    queries can run while no ingest/reset is writing. Writers have priority: a
+    waiting writer holds the "<lock>.intent" file exclusively, and readers only
+    take their lock while briefly holding that file shared, so a steady stream
+    of queries cannot starve ingest or reset. On Windows, where only exclusive
+    file locks exist, reads are exclusive too. Re-entering from the same thread
+    is allowed (a writer may read); upgrading read -> write is not.
+    """
+
+    def __init__(self, lock_path, timeout=STORE_LOCK_TIMEOUT):
+        self.lock_path = lock_path
+        self.intent_path = lock_path + ".intent"
+        self.timeout = timeout
+        self._local = threading.local()
+        lock_dir = os.path.dirname(os.path.abspath(lock_path))
+        os.makedirs(lock_dir, exist_ok=True)
+
+    def _try_lock(self, handle, exclusive):
+        try:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def _unlock(self, handle):
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+    @contextmanager
+    def _acquire(self, exclusive):
+        held = getattr(self._local, "mode", None)
+        if held == "write" or (held == "read" and not exclusive):
+            yield
+            return
+        if held == "read" and exclusive:
+            raise RuntimeError("Cannot upgrade a store read lock to a write lock")
+
+        handle = open(self.lock_path, "a+")
+        intent = open(self.intent_path, "a+")
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        try:
+            if exclusive:
+                # Announce the writer first; new readers wait until it is done
+                self._wait(lambda: self._try_lock(intent, True), deadline)
+                try:
+                    self._wait(lambda: self._try_lock(handle, True), deadline)
+                finally:
+                    self._unlock(intent)
+            else:
+                self._wait(lambda: self._try_read(handle, intent), deadline)
+
+            self._local.mode = "write" if exclusive else "read"
+            try:
+                yield
+            finally:
+                self._local.mode = None
+                self._unlock(handle)
+        finally:
+            intent.close()
+            handle.close()
+
+    def _try_read(self, handle, intent):
+        """Take the shared lock only while no writer has announced itself"""
+        if not self._try_lock(intent, False):
+            return False
+        try:
+            return self._try_lock(handle, False)
+        finally:
+            self._unlock(intent)
+
+    def _wait(self, attempt, deadline):
+        while not attempt():
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Timed out waiting for store lock {self.lock_path}")
+            time.sleep(LOCK_POLL_INTERVAL)
+
+    def read(self):
+        """Shared lock for readers (queries, exports)"""
+        return self._acquire(exclusive=False)
+
+    def write(self):
+        """Exclusive lock for writers (index updates, manifest updates, reset)"""
+        return self._acquire(exclusive=True)
+
+
+def atomic_write_text(path, text, encoding="utf-8"):
+    """Write a file via a temp file + rename so readers never see a partial file"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "w", encoding=encoding) as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write_json(path, data):
+    atomic_write_text(path, json.dumps(data))
+
+
+def normalize_key(path):
+    """Platform-independent manifest key: forward slashes, no redundant segments"""
+    return posixpath.normpath(str(path).replace("\\", "/"))
@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import StoreLock
+
+
+def test_writer_is_not_starved_by_back_to_back_readers(tmp_path):
+    lock_path = str(tmp_path / "chroma.lock")
+    stop = threading.Event()
+
+    def reader():
+        # One StoreLock per thread opens its own lock file handles, like separate workers
+        lock = StoreLock(lock_path, timeout=10)
+        while not stop.is_set():
+            with lock.read():
+                time.sleep(0.02)
+
+    readers = [threading.Thread(target=reader, daemon=True) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    time.sleep(0.2)
+
+    try:
+        started = time.monotonic()
+        with StoreLock(lock_path, timeout=5).write():
+            waited = time.monotonic() - started
+    finally:
+        stop.set()
+        for thread in readers:
+            thread.join()
+
+    assert waited < 1.0
+
+
+def test_read_lock_is_reentrant_and_cannot_upgrade(tmp_path):
+    lock = StoreLock(str(tmp_path / "chroma.lock"), timeout=1)
+    with lock.read():
+        with lock.read():
+            pass
+        try:
+            with lock.write():
+                pass
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("read -> write upgrade must fail")
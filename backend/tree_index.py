@@ -0,0 +1,167 @@
+import re
+import posixpath
+
+# Tree drawing used by gitingest: "├── name", "└── name", with "│   " / "    " per level.
+# Some gitingest versions pad the "│" level with non-breaking spaces, written as escapes here.
+TREE_LINE = re.compile(r"^((?:│   |    |│\u00a0\u00a0 )*)(?:├── |└── )(.+)$")
+
+LANGUAGE_EXTENSIONS = {
+    "python": {"py", "pyi", "ipynb"},
+    "javascript": {"js", "jsx", "mjs", "cjs"},
+    "typescript": {"ts", "tsx"},
+    "java": {"java"},
+    "kotlin": {"kt", "kts"},
+    "go": {"go"},
+    "golang": {"go"},
+    "rust": {"rs"},
+    "c": {"c", "h"},
+    "c++": {"cpp", "cc", "cxx", "hpp", "hh", "h"},
+    "cpp": {"cpp", "cc", "cxx", "hpp", "hh", "h"},
+    "c#": {"cs"},
+    "csharp": {"cs"},
+    "ruby": {"rb"},
+    "php": {"php"},
+    "html": {"html", "htm"},
+    "css": {"css", "scss", "sass", "less"},
+    "json": {"json"},
+    "yaml": {"yml", "yaml"},
+    "markdown": {"md", "markdown"},
+    "shell": {"sh", "bash", "zsh"},
+    "sql": {"sql"},
+}
+
+STOPWORDS = {
+    "where", "is", "are", "the", "a", "an", "code", "logic", "file", "files", "located", "defined",
+    "implemented", "handled", "found", "for", "of", "in", "which", "what", "does", "do", "live",
+    "lives", "this", "repo", "repository", "project", "me", "show", "find", "i", "can", "my",
+}
+
+LIST_PATTERN = re.compile(
+    r"^(?:list|show|what are)(?: me)?(?: all)?(?: the)? files (?:under|in|inside|within) (?:the )?[`'\"]?([\w./-]+?)[`'\"]?(?: folder| directory| dir)?\??$"
+)
+TYPE_PATTERN = re.compile(
+    r"^(?:which|what|list|show)(?: me)?(?: all)?(?: the)? (?:files are (?:written in )?([\w#+]+)|([\w#+]+) files)(?: are there)?\??$"
+)
+WHERE_PATTERN = re.compile(r"^where(?:'s| is| are| do| does)? (.+?)\??$")
+COUNT_PATTERN = re.compile(r"^how many files(?: are there| does (?:it|this repo) have)?(?: in (?:the )?(?:repo|repository|project))?\??$")
+
+
+def parse_tree(tree_text):
+    """Parse a gitingest tree dump into repo-relative file paths (the root directory is dropped)"""
+    paths = []
+    stack = []
+    for line in tree_text.splitlines():
+        match = TREE_LINE.match(line.rstrip())
+        if not match:
+            continue
+        depth = len(match.group(1)) // 4
+        name = match.group(2).strip()
+        del stack[depth:]
+        if name.endswith("/"):
+            stack.append(name.rstrip("/"))
+            continue
+        # stack[0] is the repository root folder
+        paths.append(posixpath.join(*(stack[1:] + [name])))
+    return paths
+
+
+def parse_content_headers(content):
+    """Fallback: collect file paths from the "File: ..." headers of a content dump"""
+    return [line[len("File: "):].strip() for line in content.splitlines() if line.startswith("File: ")]
+
+
+def file_type(path):
+    name = posixpath.basename(path)
+    return name.rsplit(".", 1)[-1].lower() if "." in name else "unknown"
+
+
+class RepoTreeIndex:
+    """In-memory path index of one repository, for answering structural questions without the LLM"""
+
+    def __init__(self, repo_key, paths, name=None):
+        self.repo_key = repo_key
+        self.name = name or repo_key
+        self.paths = sorted(set(paths))
+        self.by_type = {}
+        for path in self.paths:
+            self.by_type.setdefault(file_type(path), []).append(path)
+
+    def list_dir(self, directory):
+        """Files below a directory, which may also be nested (src/components matches frontend/src/components)"""
+        directory = directory.strip("/").lower()
+        return [
+            p for p in self.paths
+            if p.lower().startswith(directory + "/") or f"/{directory}/" in p.lower()
+        ]
+
+    def with_extensions(self, extensions):
+        return [p for ext in sorted(extensions) for p in self.by_type.get(ext, [])]
+
+    def search(self, keywords):
+        """Paths containing every keyword, shortest first; partial matches are left to full RAG"""
+        matches = [p for p in self.paths if all(keyword in p.lower() for keyword in keywords)]
+        return sorted(matches, key=lambda p: (len(p), p))
+
+
+def normalize_question(query_text):
+    return re.sub(r"\s+", " ", query_text.strip().lower())
+
+
+def route_structural(query_text, indexes, max_items=50):
+    """
+    Answer path, listing and file-type questions from tree indexes.
+
+    Returns {"response", "sources", "kind"} or None when the question is not
+    structural (or the tree has no answer), in which case full RAG should run.
+    """
+    question = normalize_question(query_text)
+    if not indexes:
+        return None
+
+    def answer(kind, header, matches):
+        if not matches:
+            return None
+        lines = [header]
+        for name, path in matches[:max_items]:
+            lines.append(f"- {path}" if len(indexes) == 1 else f"- {path} ({name})")
+        if len(matches) > max_items:
+            lines.append(f"... and {len(matches) - max_items} more")
+        return {
+            "response": "\n".join(lines),
+            "sources": [f"{path} (from {name})" for name, path in matches[:max_items]],
+            "kind": kind,
+        }
+
+    match = LIST_PATTERN.match(question)
+    if match:
+        directory = match.group(1)
+        matches = [(index.name, p) for index in indexes for p in index.list_dir(directory)]
+        return answer("listing", f"Files under `{directory}`:", matches)
+
+    match = TYPE_PATTERN.match(question)
+    if match:
+        language = (match.group(1) or match.group(2)).lstrip(".")
+        extensions = LANGUAGE_EXTENSIONS.get(language, {language} if language in _known_extensions(indexes) else None)
+        if extensions:
+            matches = [(index.name, p) for index in indexes for p in index.with_extensions(extensions)]
+            return answer("file_type", f"{language.capitalize()} files ({len(matches)}):", matches)
+        return None
+
+    if COUNT_PATTERN.match(question):
+        total = sum(len(index.paths) for index in indexes)
+        parts = [f"{index.name}: {len(index.paths)} files" for index in indexes]
+        return {"response": f"{total} files in total.\n" + "\n".join(parts), "sources": [], "kind": "count"}
+
+    match = WHERE_PATTERN.match(question)
+    if match:
+        keywords = [w for w in re.findall(r"[\w-]+", match.group(1)) if w not in STOPWORDS and len(w) > 2]
+        if not keywords:
+            return None
+        matches = [(index.name, p) for index in indexes for p in index.search(keywords)]
+        return answer("path_search", f"Files matching {', '.join(keywords)}:", matches)
+
+    return None
+
+
+def _known_extensions(indexes):
+    return {ext for index in indexes for ext in index.by_type}